@@ -0,0 +1,105 @@
+# async_database.py
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import database
+from config import DB_WORKERS, DB_BACKGROUND_WORKERS
+from metrics import DB_SECONDS
+
+# Hilos propios para la base de datos: cada uno mantiene su conexión persistente
+# y las consultas nunca bloquean el bucle de eventos de Telegram. Los comandos del
+# bot tienen su propio pool, así que no esperan detrás de las escrituras del
+# planificador, los workers o las exportaciones, que usan el de segundo plano
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+_background_executor = ThreadPoolExecutor(max_workers=DB_BACKGROUND_WORKERS, thread_name_prefix="db-bg")
+_background = contextvars.ContextVar("db_background", default=False)
+
+
+@contextmanager
+def background_db():
+    """
+    Las consultas hechas dentro del bloque, y en las tareas que se creen en él,
+    usan el pool de segundo plano.
+    """
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+def _timed(func, *args, **kwargs):
+    # Solo se mide la ejecución en el hilo, no la espera en la cola del pool
+    with DB_SECONDS.time(function=func.__name__):
+        return func(*args, **kwargs)
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Ejecuta una función síncrona de `database` en el pool de la base de datos.
+    """
+    loop = asyncio.get_running_loop()
+    executor = _background_executor if _background.get() else _executor
+    return await loop.run_in_executor(executor, functools.partial(_timed, func, *args, **kwargs))
+
+
+def run_db_sync(func, *args, **kwargs):
+    """
+    Ejecuta una función de `database` en el pool de segundo plano desde un hilo
+    ajeno (p. ej. el servidor de métricas) y espera el resultado, reutilizando
+    las conexiones del pool en lugar de abrir una por hilo.
+    """
+    return _background_executor.submit(functools.partial(_timed, func, *args, **kwargs)).result()
+
+
+def _to_async(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+
+# Versiones asíncronas de la API de `database` (la API síncrona se mantiene
+# para la GUI y los scripts)
+init_db = _to_async(database.init_db)
+add_user = _to_async(database.add_user)
+add_product = _to_async(database.add_product)
+add_products = _to_async(database.add_products)
+update_items_info = _to_async(database.update_items_info)
+get_products = _to_async(database.get_products)
+remove_product = _to_async(database.remove_product)
+record_price_changes = _to_async(database.record_price_changes)
+get_price_history = _to_async(database.get_price_history)
+get_price_history_points = _to_async(database.get_price_history_points)
+get_history_key = _to_async(database.get_history_key)
+get_item_info = _to_async(database.get_item_info)
+save_cached_products = _to_async(database.save_cached_products)
+get_cached_product = _to_async(database.get_cached_product)
+get_last_price = _to_async(database.get_last_price)
+get_price_snapshot = _to_async(database.get_price_snapshot)
+get_price_stats = _to_async(database.get_price_stats)
+get_change_frequencies = _to_async(database.get_change_frequencies)
+get_all_products = _to_async(database.get_all_products)
+update_product_price = _to_async(database.update_product_price)
+start_sweep = _to_async(database.start_sweep)
+checkpoint_sweep = _to_async(database.checkpoint_sweep)
+finish_sweep = _to_async(database.finish_sweep)
+set_alert_rule = _to_async(database.set_alert_rule)
+clear_alert_rules = _to_async(database.clear_alert_rules)
+get_alert_rules = _to_async(database.get_alert_rules)
+match_alert_rules = _to_async(database.match_alert_rules)
+get_conversation_state = _to_async(database.get_conversation_state)
+set_conversation_state = _to_async(database.set_conversation_state)
+delete_conversation_state = _to_async(database.delete_conversation_state)
+get_unscheduled_items = _to_async(database.get_unscheduled_items)
+add_scrape_jobs = _to_async(database.add_scrape_jobs)
+lease_scrape_jobs = _to_async(database.lease_scrape_jobs)
+complete_scrape_jobs = _to_async(database.complete_scrape_jobs)
+get_next_job_due = _to_async(database.get_next_job_due)
+get_scrape_demand = _to_async(database.get_scrape_demand)
+queue_notifications = _to_async(database.queue_notifications)
+get_queued_notifications = _to_async(database.get_queued_notifications)
+delete_notifications = _to_async(database.delete_notifications)
@@ -0,0 +1,148 @@
+# benchmark.py
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+# price_checker crea el bot al importarse: sin un token configurado basta uno ficticio,
+# porque las notificaciones del benchmark nunca llegan a Telegram
+os.environ.setdefault("TOKEN", "0:benchmark")
+
+import async_database
+import database
+import price_checker
+from http_client import LIMITS, set_async_transport
+from notifier import NotificationDispatcher
+from parse_pool import parse_pool
+from replay_server import DEFAULT_PAGES, ReplayServer, ReplayTransport
+
+
+class BenchmarkBot:
+    """
+    Sustituto del bot de Telegram que solo cuenta los mensajes enviados.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent_at = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        self.sent_at.append(time.perf_counter())
+
+
+class Timer:
+    """
+    Envuelve una corrutina y acumula el número de llamadas y el tiempo que tardan.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.calls = 0
+        self.elapsed = 0.0
+
+    async def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self.func(*args, **kwargs)
+        finally:
+            self.elapsed += time.perf_counter() - start
+            self.calls += 1
+
+    def reset(self):
+        self.calls = 0
+        self.elapsed = 0.0
+
+
+def populate(products: int, users: int):
+    """
+    Crea `products` productos sintéticos repartidos entre `users` usuarios.
+    """
+    urls = [f"https://www.amazon.es/dp/B{i:09d}" for i in range(products)]
+    for user_id in range(1, users + 1):
+        database.add_products(user_id, urls[user_id - 1::users])
+
+
+async def run_sweeps(args, server: ReplayServer):
+    bot = BenchmarkBot(args.telegram_latency)
+    notifier = price_checker.notifier = NotificationDispatcher(bot)
+    # Hora a la que se encola cada aviso: el envío se mide desde el primero hasta el último mensaje
+    queued_at = []
+    enqueue = notifier.notify
+
+    def notify(*args, **kwargs):
+        queued_at.append(time.perf_counter())
+        return enqueue(*args, **kwargs)
+
+    notifier.notify = notify
+    # Tiempo de parseo (incluida la ida y vuelta al pool de procesos) y de base de datos
+    parse_timer = parse_pool.parse = Timer(parse_pool.parse)
+    db_timer = async_database.run_db = Timer(async_database.run_db)
+
+    print(f"{'barrido':>7} {'productos':>9} {'fallos':>6} {'peticiones':>10} {'s':>7} "
+          f"{'páginas/s':>9} {'parseo ms/pág':>13} {'BD ms':>8} {'avisos':>6} {'envío ms':>8}")
+    for sweep in range(1, args.sweeps + 1):
+        parse_timer.reset()
+        db_timer.reset()
+        bot.sent_at.clear()
+        queued_at.clear()
+        requests = server.requests
+
+        start = time.perf_counter()
+        checked = await price_checker.check_prices()
+        elapsed = time.perf_counter() - start
+        db_ms = db_timer.elapsed * 1000
+
+        # Las notificaciones se envían a su propio ritmo, también después del barrido
+        await notifier.join()
+        sent = len(bot.sent_at)
+        drain_ms = (bot.sent_at[-1] - queued_at[0]) * 1000 if sent else 0.0
+        parse_ms = parse_timer.elapsed / parse_timer.calls * 1000 if parse_timer.calls else 0.0
+
+        print(f"{sweep:>7} {len(checked):>9} {args.products - len(checked):>6} "
+              f"{server.requests - requests:>10} {elapsed:>7.2f} {len(checked) / elapsed:>9.1f} "
+              f"{parse_ms:>13.2f} {db_ms:>8.1f} {sent:>6} {drain_ms:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mide un barrido completo de check_prices contra el servidor de réplica local. "
+                    "Respeta la configuración del entorno (FETCH_RATE, FETCH_WORKERS, PARSE_WORKERS, "
+                    "NOTIFY_RATE...); por ejemplo, FETCH_RATE=0 mide sin límite de ritmo."
+    )
+    parser.add_argument("--products", type=int, default=200, help="productos sintéticos")
+    parser.add_argument("--users", type=int, default=20, help="usuarios entre los que se reparten")
+    parser.add_argument("--sweeps", type=int, default=3, help="barridos a medir (el primero no avisa)")
+    parser.add_argument("--pages", default=DEFAULT_PAGES, help="directorio con las páginas guardadas")
+    parser.add_argument("--latency", type=float, default=0.05, help="latencia del servidor, en segundos")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latencia aleatoria añadida, en segundos")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="proporción de respuestas 429/503")
+    parser.add_argument("--captcha-rate", type=float, default=0.0, help="proporción de páginas de captcha")
+    parser.add_argument("--change-rate", type=float, default=0.2, help="probabilidad de cambio de precio por petición")
+    parser.add_argument("--etag", action="store_true", help="peticiones condicionales con ETag / 304")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="latencia simulada de cada envío a Telegram")
+    args = parser.parse_args()
+
+    server = ReplayServer(args.pages, latency=args.latency, jitter=args.jitter,
+                          throttle_rate=args.throttle_rate, captcha_rate=args.captcha_rate,
+                          change_rate=args.change_rate, etag=args.etag, seed=0).start()
+    set_async_transport(ReplayTransport(server.url, LIMITS))
+
+    with tempfile.TemporaryDirectory() as directory:
+        database.DB_NAME = os.path.join(directory, "benchmark.db")
+        database.init_db()
+        start = time.perf_counter()
+        populate(args.products, max(1, args.users))
+        print(f"{args.products} productos creados en {time.perf_counter() - start:.2f} s ({server.url})")
+        try:
+            asyncio.run(run_sweeps(args, server))
+        finally:
+            parse_pool.close()
+            server.stop()
+            database.close_connection()
+
+
+if __name__ == "__main__":
+    main()
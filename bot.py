@@ -3,6 +3,7 @@
 import os
 import asyncio
 import threading
+import time
 
 from dotenv import load_dotenv
 from telegram import Bot
@@ -12,12 +13,31 @@ from telegram.ext import (
 )
 
 
+from async_database import background_db, run_db_sync
 from commands import (
     start, add_url, list_urls, check_price, remove_url, 
-    show_history, help_command, menu_handler, handle_user_input
+    show_history, show_stats, set_alert, import_command, export_command,
+    help_command, menu_handler, handle_user_input, handle_document
 )
-from database import init_db
-from price_checker import check_prices
+from config import SCHEDULER_MODE, CHECK_INTERVAL, METRICS_PORT, METRICS_HOST, WORKER_POLL
+from database import init_db, get_last_sweep
+from metrics import (
+    REGISTRY, SCHEDULE_LAG, LAST_SWEEP_START, LAST_SWEEP_END, LAST_SWEEP_DURATION, LAST_SWEEP_ITEMS,
+    start_metrics_server,
+)
+from price_checker import check_items, dispatch_outbox, sweeps
+from scheduler import AdaptiveScheduler
+
+def _collect_last_sweep():
+    # Se lee de la tabla `sweeps` una vez por exposición: incluye barridos de antes de un reinicio
+    sweep = run_db_sync(get_last_sweep)
+    if sweep is None:
+        return
+    started_at, finished_at, duration, items_checked, _ = sweep
+    LAST_SWEEP_START.set(started_at)
+    LAST_SWEEP_END.set(finished_at)
+    LAST_SWEEP_DURATION.set(duration)
+    LAST_SWEEP_ITEMS.set(items_checked)
 
 def run_bot():
     """
@@ -39,15 +59,33 @@ def run_bot():
 
     # ----------------- SCHEDULER / VERIFICACIÓN PERIÓDICA -----------------
     async def periodic_check(interval):
-        await check_prices()  # Primera verificación
+        planned = time.monotonic()
         while True:
-            await asyncio.create_task(check_prices()) 
-            await asyncio.sleep(interval)
+            started = time.monotonic()
+            # Retraso respecto a la hora prevista (un barrido que dura más que el intervalo retrasa el siguiente)
+            SCHEDULE_LAG.observe(max(0.0, started - planned))
+            try:
+                # Como mucho un barrido activo; si el anterior quedó a medias, se retoma
+                await sweeps.run()
+            except Exception as e:
+                print(f"Error durante el barrido: {e}")
+            # El intervalo se cuenta desde el inicio del barrido
+            planned = started + interval
+            await asyncio.sleep(max(0, planned - time.monotonic()))
 
     def run_scheduler():
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
-        loop.run_until_complete(periodic_check(3600))  # Cada 1 hora
+        # Las consultas del planificador van al pool de la BD de segundo plano
+        with background_db():
+            if SCHEDULER_MODE == "fixed":
+                loop.run_until_complete(periodic_check(CHECK_INTERVAL))
+            elif SCHEDULER_MODE == "workers":
+                # Los precios los revisan los procesos --run-worker: aquí solo se envían sus avisos
+                loop.run_until_complete(dispatch_outbox(WORKER_POLL))
+            else:
+                # Cada producto se revisa según lo que suele cambiar su precio
+                loop.run_until_complete(AdaptiveScheduler(check_items).run())
 
     def start_scheduler():
         thread = threading.Thread(target=run_scheduler, daemon=True)
@@ -57,6 +95,11 @@ def run_bot():
     def bot_main():
         init_db()
 
+        if METRICS_PORT:
+            REGISTRY.add_collector(_collect_last_sweep)
+            start_metrics_server(METRICS_PORT, METRICS_HOST)
+            print(f"Métricas disponibles en http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
         application = Application.builder().token(TOKEN).build()
 
         # Registrar comandos
@@ -66,9 +109,14 @@ def run_bot():
         application.add_handler(CommandHandler("checkprice", check_price))
         application.add_handler(CommandHandler("remove", remove_url))
         application.add_handler(CommandHandler("history", show_history))
+        application.add_handler(CommandHandler("stats", show_stats))
+        application.add_handler(CommandHandler("alert", set_alert))
+        application.add_handler(CommandHandler("import", import_command))
+        application.add_handler(CommandHandler("export", export_command))
         application.add_handler(CommandHandler("help", help_command))
         application.add_handler(CallbackQueryHandler(menu_handler))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_user_input))
+        application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
 
         start_scheduler()
 
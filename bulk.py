@@ -0,0 +1,201 @@
+# bulk.py
+import asyncio
+import csv
+import io
+import json
+import re
+import sys
+
+import database
+from async_database import add_products, update_items_info, run_db, background_db
+from config import IMPORT_MAX_ITEMS
+from fetcher import get_fetch_engine
+from http_client import HTTP_NOT_MODIFIED, validators
+from parse_pool import parse_pool
+from price_tracker import lookup_product_info
+from product_cache import product_cache
+from utils import is_valid_amazon_url, canonicalize_url, get_item_key
+
+# Cualquier URL dentro de una línea de texto o una celda de un CSV
+URL_PATTERN = re.compile(r'https?://[^\s,;"\'<>]+', re.IGNORECASE)
+
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_COLUMNS = ["url", "name", "timestamp", "price", "currency", "availability"]
+
+
+# ----------------- IMPORTACIÓN -----------------
+def parse_import(text: str, max_items: int = IMPORT_MAX_ITEMS) -> tuple:
+    """
+    Extrae las URLs de Amazon de un texto (una URL por línea, un CSV o un export de /export).
+
+    Returns:
+        tuple: (URLs canónicas sin duplicados en su orden original,
+        número de URLs no válidas, número de duplicadas, número de URLs descartadas por
+        superar `max_items`).
+    """
+    urls, seen = [], set()
+    invalid = duplicates = skipped = 0
+    for candidate in URL_PATTERN.findall(text):
+        if not is_valid_amazon_url(candidate):
+            invalid += 1
+            continue
+        url = canonicalize_url(candidate)
+        key = get_item_key(url)
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        if len(urls) >= max_items:
+            skipped += 1
+            continue
+        urls.append(url)
+    return urls, invalid, duplicates, skipped
+
+
+async def resolve_items(items: list) -> tuple:
+    """
+    Descarga con el motor asíncrono el nombre y el precio de productos recién añadidos
+    y los guarda en una sola transacción.
+
+    Args:
+        items (list): Pares (item_id, URL) de los productos sin descargar que devuelve `add_products`.
+
+    Returns:
+        tuple: (productos resueltos, productos que no se pudieron descargar).
+    """
+    results = []
+    failed = 0
+
+    async def handle_result(job, response, error):
+        nonlocal failed
+        item_id, url = job
+        if error is not None:
+            failed += 1
+            return
+        if response.status_code == HTTP_NOT_MODIFIED:
+            result = validators.value(url)
+            if result is None:
+                failed += 1
+                return
+        else:
+            result = await parse_pool.parse(response.content)
+            validators.remember(url, response, result)
+        product_cache.put(url, result)
+        product_name, price = result
+        results.append((item_id, product_name, price))
+
+    await get_fetch_engine().run(((url, (item_id, url)) for item_id, url in items), handle_result)
+    if results:
+        await update_items_info(results)
+    await product_cache.flush()
+    return len(results), failed
+
+
+async def resolve_product(item_id: int, url: str) -> tuple:
+    """
+    Obtiene el nombre y el precio de un producto recién añadido y los guarda.
+
+    Pasa por la caché de productos: reutiliza un resultado reciente y las
+    llamadas simultáneas para la misma URL comparten una única descarga.
+
+    Returns:
+        tuple: (nombre del producto, Price).
+
+    Raises:
+        retry.FetchError, httpx.HTTPError: Si no se pudo descargar la página.
+    """
+    product_name, price = await lookup_product_info(url)
+    await update_items_info([(item_id, product_name, price)])
+    return product_name, price
+
+
+async def import_urls(user_id: int, urls: list) -> tuple:
+    """
+    Suscribe al usuario a todas las URLs de una vez y resuelve los productos nuevos.
+
+    Returns:
+        tuple: (productos añadidos a la lista, productos descargados, descargas fallidas).
+    """
+    # Una importación puede ser larga: no ocupa los hilos de la BD de los comandos
+    with background_db():
+        added, pending = await add_products(user_id, urls)
+        resolved, failed = await resolve_items(pending) if pending else (0, 0)
+    return added, resolved, failed
+
+
+# ----------------- EXPORTACIÓN -----------------
+def _export_records(user_id):
+    for url, name, timestamp, amount, currency, availability in database.iter_user_history(user_id):
+        yield {
+            "url": url,
+            "name": name,
+            "timestamp": timestamp,
+            "price": f"{amount // 100}.{amount % 100:02d}" if amount is not None else None,
+            "currency": currency,
+            "availability": availability,
+        }
+
+
+def write_export(user_id: int, out, fmt: str = "csv") -> int:
+    """
+    Escribe en `out` (archivo de texto) los productos de un usuario y su historial,
+    fila a fila, sin cargarlos en memoria.
+
+    Se ejecuta en un solo hilo (la consulta y la escritura van juntas).
+
+    Returns:
+        int: Número de filas escritas.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportación desconocido: {fmt}")
+
+    rows = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=EXPORT_COLUMNS)
+        writer.writeheader()
+        for record in _export_records(user_id):
+            writer.writerow(record)
+            rows += 1
+    else:
+        for record in _export_records(user_id):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            rows += 1
+    return rows
+
+
+async def export_to_file(user_id: int, out, fmt: str = "csv") -> int:
+    """
+    Versión asíncrona de `write_export`: la exportación completa se hace en el pool
+    de segundo plano de la base de datos, sin bloquear el bucle de eventos ni los
+    hilos de los comandos.
+    """
+    with background_db():
+        return await run_db(write_export, user_id, out, fmt)
+
+
+# ----------------- LÍNEA DE COMANDOS -----------------
+def run_cli_import(path: str, user_id: int):
+    """
+    Importa un archivo de URLs para un usuario desde la línea de comandos.
+    """
+    with open(path, encoding="utf-8", errors="replace") as source:
+        urls, invalid, duplicates, skipped = parse_import(source.read())
+    print(f"{len(urls)} URLs válidas, {invalid} no válidas, {duplicates} duplicadas, {skipped} descartadas.")
+
+    database.init_db()
+    added, resolved, failed = asyncio.run(import_urls(user_id, urls))
+    parse_pool.close()
+    print(f"{added} productos añadidos ({resolved} descargados, {failed} con error).")
+
+
+def run_cli_export(user_id: int, fmt: str = "csv"):
+    """
+    Exporta a la salida estándar los productos y el historial de un usuario.
+    """
+    database.init_db()
+    out = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="")
+    try:
+        write_export(user_id, out, fmt)
+    finally:
+        out.flush()
+        out.detach()
@@ -0,0 +1,173 @@
+# charts.py
+import asyncio
+import io
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from config import CHART_WORKERS, CHART_CACHE_SIZE, HISTORY_MAX_POINTS
+
+# Por encima de este número de puntos no se dibujan los marcadores
+MAX_MARKERS = 60
+
+
+def _parse_timestamps(timestamps):
+    try:
+        return [datetime.fromisoformat(timestamp) for timestamp in timestamps]
+    except (TypeError, ValueError):
+        # Formato desconocido: se dibujan como etiquetas, igual que antes
+        return list(timestamps)
+
+
+def lttb(x, y, threshold: int):
+    """
+    Largest-Triangle-Three-Buckets: elige `threshold` puntos de la serie que
+    conservan su forma visual (picos y valles incluidos).
+
+    Returns:
+        numpy.ndarray: Índices de los puntos elegidos, en orden.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # El primer y el último punto se conservan; el resto se reparte en threshold - 2 tramos
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        # Área del triángulo formado con el punto anterior y la media del tramo siguiente
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+
+def render_history_chart(timestamps: list, prices: list, ylabel: str,
+                         max_points: int = HISTORY_MAX_POINTS) -> bytes:
+    """
+    Dibuja la gráfica del historial de precios y la devuelve como PNG.
+
+    Usa la API orientada a objetos de matplotlib (sin el estado global de
+    pyplot), de modo que se puede llamar desde varios hilos o procesos.
+    Las series de más de `max_points` puntos se reducen con LTTB.
+    """
+    dates = _parse_timestamps(timestamps)
+    if len(dates) > max_points:
+        x = [date.timestamp() for date in dates] if dates and isinstance(dates[0], datetime) else range(len(dates))
+        keep = lttb(x, prices, max_points)
+        dates = [dates[i] for i in keep]
+        prices = [prices[i] for i in keep]
+
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    ax.plot(dates, prices, marker="o" if len(dates) <= MAX_MARKERS else None)
+    ax.set_title("Historial de precios")
+    ax.set_xlabel("Fecha")
+    ax.set_ylabel(ylabel)
+    ax.grid()
+    ax.tick_params(axis="x", labelrotation=45)
+    figure.tight_layout()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+class ChartRenderer:
+    """
+    Dibuja las gráficas de /history fuera del bucle de eventos y guarda las
+    últimas en memoria, indexadas por la versión del historial, para que
+    repetir /history sobre una serie sin cambios responda al instante.
+    """
+
+    def __init__(self, workers: int = CHART_WORKERS, cache_size: int = CHART_CACHE_SIZE):
+        self.workers = workers
+        self.executor = None
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _get_executor(self):
+        # El pool se crea la primera vez que se usa, con "spawn" como el de parseo
+        with self.lock:
+            if self.executor is None and self.workers > 0:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self.executor
+
+    def _discard(self, executor):
+        # Un proceso del pool murió: se descarta el pool para crear otro
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def cached(self, key):
+        """
+        PNG guardado para `key`, o None.
+        """
+        with self.lock:
+            png = self.cache.get(key)
+            if png is not None:
+                self.cache.move_to_end(key)
+            return png
+
+    async def render(self, key, timestamps: list, prices: list, ylabel: str) -> bytes:
+        """
+        Devuelve el PNG de la gráfica, dibujándolo solo si no está en la caché.
+
+        Args:
+            key: Versión del historial, p. ej. (item_id, último timestamp).
+        """
+        png = self.cached(key)
+        if png is not None:
+            return png
+
+        executor = self._get_executor()
+        if executor is None:
+            png = await asyncio.to_thread(render_history_chart, timestamps, prices, ylabel)
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                png = await loop.run_in_executor(executor, render_history_chart, timestamps, prices, ylabel)
+            except BrokenProcessPool:
+                self._discard(executor)
+                png = await loop.run_in_executor(
+                    self._get_executor(), render_history_chart, timestamps, prices, ylabel
+                )
+
+        with self.lock:
+            self.cache[key] = png
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return png
+
+    def close(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+# Renderizador compartido por todos los comandos del bot
+chart_renderer = ChartRenderer()
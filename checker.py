@@ -0,0 +1,110 @@
+# checker.py
+from parse_pool import parse_pool
+from async_database import (
+    record_price_changes, update_items_info, get_price_snapshot, match_alert_rules,
+)
+from fetcher import get_fetch_engine
+from http_client import HTTP_NOT_MODIFIED, validators
+from metrics import ITEMS_CHECKED
+from product_cache import product_cache
+
+# Revisión de precios sin dependencias de Telegram: la usan tanto el bot
+# (price_checker) como los workers (--run-worker), que no tienen token.
+
+def plan_sweep(products):
+    """
+    Agrupa las filas de productos por producto de Amazon.
+
+    Args:
+        products (list): Filas (item_id, user_id, url, name) de `get_all_products`.
+
+    Returns:
+        dict: item_id -> (URL canónica, lista de usuarios que siguen el producto).
+    """
+    plan = {}
+    for item_id, user_id, url, name in products:
+        plan.setdefault(item_id, (url, []))[1].append(user_id)
+    return plan
+
+async def check_items(plan, deliver):
+    """
+    Descarga los productos de `plan`, registra los cambios de precio y avisa a sus suscriptores.
+
+    Args:
+        plan (dict): item_id -> (URL canónica, lista de usuarios), como devuelve `plan_sweep`.
+        deliver (callable): Corrutina que recibe los avisos como filas (user_id, item_id, nombre,
+            URL, Price anterior, Price nuevo). El bot los encola en su notificador y los
+            workers los dejan en la base de datos para que los envíe el bot.
+
+    Returns:
+        dict: item_id -> True si el precio ha cambiado, para cada producto descargado con éxito.
+    """
+    # Últimos precios conocidos, cargados en una sola consulta al empezar el barrido
+    snapshot = await get_price_snapshot(list(plan))
+    changes = []
+    # Productos añadidos que aún no se habían podido consultar: se guarda su nombre y su primer precio
+    first_seen = []
+    checked = {}
+
+    async def handle_result(job, response, error):
+        item_id, url, user_ids = job
+        if error is not None:
+            ITEMS_CHECKED.inc(result="failed")
+            print(f"No se pudo descargar {url}: {error}")
+            return
+
+        if response.status_code == HTTP_NOT_MODIFIED:
+            # La página no ha cambiado desde la última descarga: se reutiliza su resultado
+            result = validators.value(url)
+            if result is None:
+                # Descartado justo después de la descarga: se cuenta como fallo
+                ITEMS_CHECKED.inc(result="failed")
+                print(f"No se pudo reutilizar el resultado de {url}")
+                return
+        else:
+            # Parsear en el pool de procesos para no bloquear el bucle de eventos
+            result = await parse_pool.parse(response.content)
+            validators.remember(url, response, result)
+        # Los comandos del bot reutilizan este resultado mientras esté reciente
+        product_cache.put(url, result)
+        product_name, current_price = result
+        last_price = snapshot.get(item_id)
+        checked[item_id] = current_price != last_price
+        ITEMS_CHECKED.inc(result="changed" if checked[item_id] else "unchanged")
+
+        if last_price is None:
+            first_seen.append((item_id, product_name, current_price))
+        elif current_price != last_price:
+            changes.append((item_id, url, user_ids, product_name, last_price, current_price))
+
+    await get_fetch_engine().run(
+        ((url, (item_id, url, user_ids)) for item_id, (url, user_ids) in plan.items()),
+        handle_result
+    )
+
+    # Guardar todos los cambios del barrido en una única transacción
+    # (el historial es único por producto: cada cambio se registra una sola vez)
+    await record_price_changes([(item_id, current_price) for item_id, *_, current_price in changes])
+    if first_seen:
+        await update_items_info(first_seen)
+    await product_cache.flush()
+    if not changes:
+        return checked
+
+    # Evaluar en bloque las reglas de aviso de los suscriptores de los productos que han cambiado
+    matches = await match_alert_rules([
+        (item_id, last_price, current_price) for item_id, *_, last_price, current_price in changes
+    ])
+    recipients = {}
+    for user_id, item_id in matches:
+        recipients.setdefault(item_id, []).append(user_id)
+
+    # Avisar solo a los usuarios cuyas reglas se cumplen
+    notifications = [
+        (user_id, item_id, product_name, url, last_price, current_price)
+        for item_id, url, user_ids, product_name, last_price, current_price in changes
+        for user_id in recipients.get(item_id, [])
+    ]
+    if notifications:
+        await deliver(notifications)
+    return checked
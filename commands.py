@@ -1,17 +1,26 @@
 # commands.py
-import matplotlib
-matplotlib.use('Agg') 
+import io
+import tempfile
 from telegram import Update
 from telegram.ext import ContextTypes
-from utils import is_valid_amazon_url
-from price_tracker import get_price
-from price_tracker import get_product_info
-from database import add_user, add_product, get_products, remove_product, get_price_history, record_price_change, get_all_products, get_last_price
-import matplotlib.pyplot as plt
-import os
-import time
+from datetime import datetime, timezone
+from utils import is_valid_amazon_url, canonicalize_url, parse_window
+import httpx
+from price_tracker import fetch_price
+from retry import FetchError
+from async_database import (
+    add_products, get_item_info, get_products, remove_product, get_price_history_points, get_history_key, get_price_stats,
+    set_alert_rule, clear_alert_rules, get_alert_rules,
+)
+from bulk import parse_import, import_urls, resolve_product, export_to_file, EXPORT_FORMATS
+from charts import chart_renderer
+from product_cache import product_cache
+from config import HISTORY_BUCKETS, IMPORT_MAX_BYTES
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from utils import user_states
+from state_store import user_states
+from prices import Price, Availability, format_price, parse_user_amount, CURRENCY_DISPLAY
+
+FETCH_ERROR_TEXT = "No se pudo consultar el producto en Amazon. Inténtalo de nuevo más tarde."
 
 
 # Función para el comando /help
@@ -23,7 +32,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "/list - Mostrar la lista de productos monitoreados\n"
         "/checkprice <URL> - Consultar el precio actual de un producto\n"
         "/remove <número> - Eliminar un producto monitoreado por su número en /list\n"
-        "/history <URL> - Ver el historial de precios de un producto\n"
+        "/history <URL> [7d|30d|1y] - Ver el historial de precios de un producto\n"
+        "/stats <URL> - Ver los precios mínimo, máximo y medio de un producto\n"
+        "/alert <número> [regla] - Elegir cuándo avisarte de un producto (usa /alert para ver las reglas)\n"
+        "/import [URLs] - Añadir varios productos a la vez (o envía un archivo con las URLs)\n"
+        "/export [csv|jsonl] - Descargar tus productos y su historial\n"
         "/help - Mostrar este mensaje de ayuda\n"
     )
     await update.message.reply_text(help_text, parse_mode="Markdown")
@@ -43,27 +56,50 @@ async def add_url(update, context):
         await update.message.reply_text("La URL proporcionada no es válida para Amazon.")
         return
 
+    await add_and_reply(update, context, canonicalize_url(url))
+
+# Añadir un producto a la lista del usuario y responder al momento. Si el producto aún
+# no se ha consultado nunca, su nombre y precio se resuelven en segundo plano y se
+# edita la respuesta cuando llegan.
+async def add_and_reply(update, context, url):
     user_id = update.message.chat_id
-    product_name, product_price = get_product_info(url)
-    add_user(user_id)
-    add_product(user_id, url, product_name, product_price)
-    products = get_all_products()
-    for product in products:
-            product_id, user_id, url, name = product
+    added, _ = await add_products(user_id, [url])
+    item_id, product_name, product_price = await get_item_info(url)
+    if not added:
+        # La suscripción ya existía: no se vuelve a consultar el producto
+        if product_price is None:
+            await update.message.reply_text("Ya estás siguiendo este producto.")
+        else:
+            await update.message.reply_text(
+                f"Ya estás siguiendo este producto: {product_name} - {format_price(product_price)}"
+            )
+        return
+    if product_price is not None:
+        # Producto ya seguido por otros usuarios: sus datos ya están guardados
+        await update.message.reply_text(f"Producto añadido: {product_name} - {format_price(product_price)}")
+        return
 
-            product_name, current_price = get_product_info(url)
-            last_price = get_last_price(product_id)
+    reply = await update.message.reply_text("Producto añadido. Consultando su nombre y precio...")
 
-    record_price_change(product_id, current_price)
+    async def finish():
+        try:
+            product_name, product_price = await resolve_product(item_id, url)
+        except (httpx.HTTPError, FetchError):
+            await reply.edit_text(
+                "Producto añadido, pero no se pudo consultar en Amazon. "
+                "Su precio se revisará en la próxima comprobación."
+            )
+            return
+        await reply.edit_text(f"Producto añadido: {product_name} - {format_price(product_price)}")
 
-    await update.message.reply_text(f"Producto añadido: {product_name} - {product_price}")
+    context.application.create_task(finish())
 
 # Función para el comando /list
 async def list_urls(update, context):
     user_id = (
         update.callback_query.message.chat_id if update.callback_query else update.message.chat_id
     )
-    products = get_products(user_id)
+    products = await get_products(user_id)
 
     if not products:
         if update.callback_query:
@@ -75,7 +111,7 @@ async def list_urls(update, context):
     # Crear mensaje con productos
     message = "Productos en seguimiento:\n"
     for index, (url, name, price) in enumerate(products, start=1):
-        message += f"{index}. [{name}]({url}) - {price}\n"
+        message += f"{index}. [{name}]({url}) - {format_price(price)}\n"
 
     if update.callback_query:
         await update.callback_query.edit_message_text(message, parse_mode="Markdown")
@@ -88,12 +124,20 @@ async def check_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await update.message.reply_text('Por favor, proporciona una URL después del comando /checkprice.')
         return
 
-    url = context.args[0]
-    await update.message.reply_text('Extrayendo precio, por favor espera...')
+    await reply_price(update, context.args[0])
 
-    # Llamar a la función para obtener el precio
-    price = get_price(url)
-    await update.message.reply_text(f'El precio del producto es: {price}')
+# Responder con el precio actual de un producto. Si se descargó hace poco (en el barrido
+# o en otra consulta) se responde al momento con el resultado de la caché de productos
+async def reply_price(update, url):
+    if await product_cache.lookup(url) is None:
+        await update.message.reply_text('Extrayendo precio, por favor espera...')
+
+    try:
+        price = await fetch_price(url)
+    except (httpx.HTTPError, FetchError):
+        await update.message.reply_text(FETCH_ERROR_TEXT)
+        return
+    await update.message.reply_text(f'El precio del producto es: {format_price(price)}')
 
 
 async def remove_url(update, context):
@@ -108,7 +152,7 @@ async def remove_url(update, context):
     try:
         # Obtener el número del producto desde el argumento
         product_index = int(context.args[0]) - 1  # Ajustar índice para que comience en 0
-        products = get_products(user_id)
+        products = await get_products(user_id)
 
         if not products:
             await update.message.reply_text('No tienes productos en seguimiento. Usa /list para ver tus productos.')
@@ -121,7 +165,7 @@ async def remove_url(update, context):
 
         # Obtener la URL del producto seleccionado
         url_to_remove = products[product_index][0]
-        remove_product(user_id, url_to_remove)
+        await remove_product(user_id, url_to_remove)
 
         await update.message.reply_text(f'El producto "{products[product_index][1]}" ha sido eliminado del seguimiento.')  # Nombre del producto
     except ValueError:
@@ -130,39 +174,238 @@ async def remove_url(update, context):
 async def show_history(update, context):
     # Verificar si hay argumentos (URL) en el contexto
     if not context.args or len(context.args) == 0:
-        await update.message.reply_text("Por favor, proporciona la URL del producto. Ejemplo: /history <URL>")
+        await update.message.reply_text("Por favor, proporciona la URL del producto. Ejemplo: /history <URL> [7d|30d|1y]")
         return
 
-    url = context.args[0]
+    url = canonicalize_url(context.args[0])
     user_id = update.message.chat_id
 
-    # Obtener el historial de la base de datos
-    history = get_price_history(user_id, url)
-    if not history:
-        await update.message.reply_text("No se encontró historial de precios para este producto.")
+    # Ventana de tiempo opcional: 7d, 30d, 1y...
+    window = context.args[1] if len(context.args) > 1 else None
+    since = ""
+    if window:
+        delta = parse_window(window)
+        if delta is None:
+            await update.message.reply_text("Periodo no válido. Usa, por ejemplo, 7d, 30d o 1y.")
+            return
+        # Los timestamps se guardan en UTC con el formato de CURRENT_TIMESTAMP
+        since = (datetime.now(timezone.utc) - delta).strftime("%Y-%m-%d %H:%M:%S")
+
+    # La versión del historial (producto + último cambio) y el periodo, redondeado
+    # al día, identifican la gráfica en la caché
+    key = await get_history_key(user_id, url)
+    if key:
+        key = (*key, window, since[:10])
+    png = chart_renderer.cached(key) if key else None
+    if png is None:
+        # Obtener de la base de datos el historial ya reducido (sin los periodos sin precio)
+        history = await get_price_history_points(user_id, url, since, HISTORY_BUCKETS)
+        if not key or not history:
+            await update.message.reply_text("No se encontró historial de precios para este producto.")
+            return
+
+        # Generar la gráfica fuera del bucle de eventos
+        timestamps = [timestamp for timestamp, price in history]
+        prices = [price.amount / 100 for timestamp, price in history]
+        currency = history[-1][1].currency
+        ylabel = f"Precio ({CURRENCY_DISPLAY.get(currency, currency)})"
+        png = await chart_renderer.render(key, timestamps, prices, ylabel)
+
+    await update.message.reply_photo(photo=png)
+
+
+# Palabras del comando /alert para cada tipo de regla
+ALERT_RULE_WORDS = {
+    "precio": "target",
+    "bajada": "pct_drop",
+    "minimo": "all_time_low",
+    "mínimo": "all_time_low",
+    "stock": "back_in_stock",
+    "cualquiera": "any",
+}
+
+ALERT_HELP_TEXT = (
+    "Uso: /alert <número> [regla]\n"
+    "Reglas (se avisa si se cumple cualquiera de ellas):\n"
+    "  precio <importe> - el precio baja hasta el importe o menos\n"
+    "  bajada <porcentaje> - el precio baja al menos ese porcentaje\n"
+    "  minimo - el precio es el más bajo registrado\n"
+    "  stock - el producto vuelve a estar disponible\n"
+    "  cualquiera - cualquier cambio de precio\n"
+    "  borrar - elimina las reglas (se avisa de cualquier cambio)\n"
+    "Sin regla se muestran las reglas actuales del producto."
+)
+
+
+def describe_alert_rule(kind, threshold, currency):
+    if kind == "target":
+        return f"el precio baja hasta {format_price(Price(int(threshold), currency, Availability.AVAILABLE))} o menos"
+    if kind == "pct_drop":
+        return f"el precio baja al menos un {threshold:g} %"
+    if kind == "all_time_low":
+        return "el precio es el más bajo registrado"
+    if kind == "back_in_stock":
+        return "el producto vuelve a estar disponible"
+    return "cualquier cambio de precio"
+
+
+# Función para el comando /alert
+async def set_alert(update, context):
+    if not context.args:
+        await update.message.reply_text(ALERT_HELP_TEXT)
         return
 
-    # Generar la gráfica
-    timestamps, prices = zip(*history)
-    prices = [float(price.replace(",", ".").replace(" €", "")) for price in prices]
+    user_id = update.message.chat_id
+    products = await get_products(user_id)
+    try:
+        product_index = int(context.args[0]) - 1
+    except ValueError:
+        product_index = -1
+    if not 0 <= product_index < len(products):
+        await update.message.reply_text('El número del producto no es válido. Usa /list para ver tus productos.')
+        return
+    url, name, price = products[product_index]
+    currency = price.currency if price else "EUR"
 
-    # Crear el gráfico
-    plt.figure(figsize=(10, 6))
-    plt.plot(timestamps, prices, marker="o")
-    plt.title("Historial de precios")
-    plt.xlabel("Fecha")
-    plt.ylabel("Precio (€)")
-    plt.grid()
-    plt.xticks(rotation=45)
+    if len(context.args) == 1:
+        rules = await get_alert_rules(user_id, url)
+        if not rules:
+            await update.message.reply_text(f'"{name}": se te avisa de cualquier cambio de precio.')
+        else:
+            lines = "\n".join(f"- {describe_alert_rule(kind, threshold, currency)}" for kind, threshold in rules)
+            await update.message.reply_text(f'"{name}": se te avisa cuando\n{lines}')
+        return
 
-    # Guardar y enviar la imagen
-    file_path = f"history_{user_id}_{int(time.time())}.png"
-    plt.tight_layout()
-    plt.savefig(file_path)
-    plt.close()
+    word = context.args[1].lower()
+    if word == "borrar":
+        await clear_alert_rules(user_id, url)
+        await update.message.reply_text(f'Reglas eliminadas: se te avisará de cualquier cambio de precio de "{name}".')
+        return
 
-    await update.message.reply_photo(photo=open(file_path, "rb"))
-    os.remove(file_path)
+    kind = ALERT_RULE_WORDS.get(word)
+    threshold = None
+    if kind == "target":
+        threshold = parse_user_amount(" ".join(context.args[2:])) if len(context.args) > 2 else None
+    elif kind == "pct_drop":
+        try:
+            threshold = float(context.args[2].rstrip("%").replace(",", ".")) if len(context.args) > 2 else None
+        except ValueError:
+            threshold = None
+        if threshold is not None and not 0 < threshold < 100:
+            threshold = None
+    if kind is None or (kind in ("target", "pct_drop") and threshold is None):
+        await update.message.reply_text(ALERT_HELP_TEXT)
+        return
+
+    await set_alert_rule(user_id, url, kind, threshold)
+    await update.message.reply_text(
+        f'Te avisaré cuando {describe_alert_rule(kind, threshold, currency)}: "{name}".'
+    )
+
+# Importar varias URLs: responde al momento y descarga los productos en segundo plano
+async def start_import(update, context, text):
+    user_id = update.message.chat_id
+    urls, invalid, duplicates, skipped = parse_import(text)
+    if not urls:
+        await update.message.reply_text("No se encontró ninguna URL válida de Amazon para importar.")
+        return
+
+    summary = f"Importando {len(urls)} productos"
+    details = [f"{count} {label}" for count, label in (
+        (invalid, "URLs no válidas"), (duplicates, "duplicadas"), (skipped, "por encima del límite"),
+    ) if count]
+    if details:
+        summary += f" (descartadas: {', '.join(details)})"
+    await update.message.reply_text(summary + ". Te avisaré al terminar.")
+
+    async def run_import():
+        try:
+            added, resolved, failed = await import_urls(user_id, urls)
+        except Exception as e:
+            print(f"Error al importar productos de {user_id}: {e}")
+            await context.bot.send_message(chat_id=user_id, text="No se pudo completar la importación.")
+            return
+        text = f"Importación terminada: {added} productos nuevos en tu lista."
+        if failed:
+            text += f" No se pudo consultar {failed} de ellos todavía; se revisarán en la próxima comprobación."
+        await context.bot.send_message(chat_id=user_id, text=text)
+
+    context.application.create_task(run_import())
+
+# Función para el comando /import
+async def import_command(update, context):
+    if context.args:
+        await start_import(update, context, " ".join(context.args))
+        return
+    await user_states.set(update.message.chat_id, {"state": "waiting_for_import"})
+    await update.message.reply_text(
+        "Envía un archivo de texto o CSV con las URLs de Amazon que quieres añadir (una por línea)."
+    )
+
+# Archivos recibidos: se importan si se envían con /import en el texto o tras usar /import
+async def handle_document(update, context):
+    user_id = update.message.chat_id
+    conversation = await user_states.get(user_id) or {}
+    waiting = conversation.get("state") == "waiting_for_import"
+    if not waiting and not (update.message.caption or "").startswith("/import"):
+        await update.message.reply_text("Para importar productos desde un archivo, usa /import.")
+        return
+    await user_states.pop(user_id)
+
+    document = update.message.document
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await update.message.reply_text("El archivo es demasiado grande para importarlo.")
+        return
+    file = await document.get_file()
+    content = await file.download_as_bytearray()
+    await start_import(update, context, bytes(content).decode("utf-8", errors="replace"))
+
+# Función para el comando /export
+async def export_command(update, context):
+    fmt = context.args[0].lower() if context.args else "csv"
+    if fmt not in EXPORT_FORMATS:
+        await update.message.reply_text("Formato no válido. Usa /export csv o /export jsonl.")
+        return
+
+    user_id = update.message.chat_id
+    # Las filas se escriben una a una en un archivo temporal, sin cargarlas en memoria
+    with tempfile.TemporaryFile() as buffer:
+        text = io.TextIOWrapper(buffer, encoding="utf-8", newline="")
+        rows = await export_to_file(user_id, text, fmt)
+        text.flush()
+        text.detach()
+        if not rows:
+            await update.message.reply_text("No tienes productos en seguimiento.")
+            return
+        buffer.seek(0)
+        await update.message.reply_document(document=buffer, filename=f"productos.{fmt}")
+
+# Función para el comando /stats
+async def show_stats(update, context):
+    if not context.args:
+        await update.message.reply_text("Por favor, proporciona la URL del producto. Ejemplo: /stats <URL>")
+        return
+
+    url = canonicalize_url(context.args[0])
+    key = await get_history_key(update.message.chat_id, url)
+    stats = (await get_price_stats([key[0]])).get(key[0]) if key else None
+    if stats is None or not stats.samples:
+        await update.message.reply_text("No se encontraron estadísticas de precio para este producto.")
+        return
+
+    def money(amount):
+        return format_price(Price(amount, stats.currency, Availability.AVAILABLE))
+
+    await update.message.reply_text(
+        f"📊 *Estadísticas de precio*\n"
+        f"*Mínimo histórico:* {money(stats.min_cents)} ({stats.min_at[:10]})\n"
+        f"*Máximo histórico:* {money(stats.max_cents)} ({stats.max_at[:10]})\n"
+        f"*Mínimo últimos 30 días:* {money(stats.min_30d_cents)}\n"
+        f"*Mínimo últimos 90 días:* {money(stats.min_90d_cents)}\n"
+        f"*Precio medio:* {money(stats.average_cents)} ({stats.samples} cambios registrados)\n"
+        f"*Último cambio:* {stats.last_change_at}",
+        parse_mode="Markdown"
+    )
 
 
 async def button_handler(update, context):
@@ -174,14 +417,14 @@ async def button_handler(update, context):
     if data.startswith("product_"):
         product_index = int(data.split("_")[1]) - 1
         user_id = query.message.chat_id
-        products = get_products(user_id)
+        products = await get_products(user_id)
 
         if 0 <= product_index < len(products):
             url, name, price = products[product_index]
             await query.edit_message_text(
                 f"Producto seleccionado:\n\n"
                 f"*Nombre:* {name}\n"
-                f"*Precio actual:* {price}\n"
+                f"*Precio actual:* {format_price(price)}\n"
                 f"*URL:* [Enlace]({url})",
                 parse_mode="Markdown"
             )
@@ -214,18 +457,18 @@ async def menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     action = query.data
 
     if action == "add_product":
-        user_states[user_id] = {"state": "waiting_for_url"}
+        await user_states.set(user_id, {"state": "waiting_for_url"})
         await query.edit_message_text("Por favor, envía la URL del producto que deseas añadir.")
     elif action == "list_products":
         await list_urls(update, context)  # Reutiliza la función existente
     elif action == "remove_product":
-        user_states[user_id] = {"state": "waiting_for_remove"}
+        await user_states.set(user_id, {"state": "waiting_for_remove"})
         await query.edit_message_text("Por favor, envía el número del producto que deseas eliminar.")
     elif action == "check_price":
-        user_states[user_id] = {"state": "waiting_for_check"}
+        await user_states.set(user_id, {"state": "waiting_for_check"})
         await query.edit_message_text("Por favor, envía la URL del producto para consultar el precio.")
     elif action == "price_history":
-        user_states[user_id] = {"state": "waiting_for_history"}
+        await user_states.set(user_id, {"state": "waiting_for_history"})
         await query.edit_message_text("Por favor, envía la URL del producto para ver el historial de precios.")
     elif action == "help":
         await query.edit_message_text(
@@ -235,7 +478,11 @@ async def menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             "/list - Mostrar la lista de productos monitoreados\n"
             "/checkprice <URL> - Consultar el precio actual de un producto\n"
             "/remove <número> - Eliminar un producto monitoreado por su número en /list\n"
-            "/history <URL> - Ver el historial de precios de un producto\n"
+            "/history <URL> [7d|30d|1y] - Ver el historial de precios de un producto\n"
+            "/stats <URL> - Ver los precios mínimo, máximo y medio de un producto\n"
+            "/alert <número> [regla] - Elegir cuándo avisarte de un producto (usa /alert para ver las reglas)\n"
+            "/import [URLs] - Añadir varios productos a la vez (o envía un archivo con las URLs)\n"
+            "/export [csv|jsonl] - Descargar tus productos y su historial\n"
             "/help - Mostrar este mensaje de ayuda\n",
         parse_mode="Markdown"
     )
@@ -253,52 +500,54 @@ async def handle_user_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = update.message.chat_id
     user_input = update.message.text
 
-    if user_id not in user_states or "state" not in user_states[user_id]:
+    conversation = await user_states.get(user_id)
+    if not conversation or "state" not in conversation:
         await update.message.reply_text("Por favor, utiliza el menú para seleccionar una acción.")
         return
 
-    state = user_states[user_id]["state"]
+    state = conversation["state"]
 
     if state == "waiting_for_url":
         if is_valid_amazon_url(user_input):
-            product_name, product_price = get_product_info(user_input)
-            add_user(user_id)
-            add_product(user_id, user_input, product_name, product_price)
-            await update.message.reply_text(f"Producto añadido: {product_name} - {product_price}")
+            await add_and_reply(update, context, canonicalize_url(user_input))
         else:
             await update.message.reply_text("La URL proporcionada no es válida. Inténtalo de nuevo.")
-        user_states.pop(user_id) 
+        await user_states.pop(user_id)
 
     elif state == "waiting_for_remove":
         try:
             product_index = int(user_input) - 1
-            products = get_products(user_id)
+            products = await get_products(user_id)
             if 0 <= product_index < len(products):
                 url_to_remove = products[product_index][0]
-                remove_product(user_id, url_to_remove)
+                await remove_product(user_id, url_to_remove)
                 await update.message.reply_text(f'El producto "{products[product_index][1]}" ha sido eliminado del seguimiento.')
             else:
                 await update.message.reply_text("El número proporcionado no es válido.")
         except ValueError:
             await update.message.reply_text("Por favor, proporciona un número válido.")
-        user_states.pop(user_id)
+        await user_states.pop(user_id)
 
     elif state == "waiting_for_check":
         if is_valid_amazon_url(user_input):
-            price = get_price(user_input)
-            await update.message.reply_text(f'El precio del producto es: {price}')
+            await reply_price(update, user_input)
         else:
             await update.message.reply_text("La URL proporcionada no es válida. Inténtalo de nuevo.")
-        user_states.pop(user_id)
+        await user_states.pop(user_id)
 
     elif state == "waiting_for_history":
         if is_valid_amazon_url(user_input):
             await update.message.reply_text("Generando el historial de precios, por favor espera...")
-            context.args = [user_input]
+            context.args = user_input.split()
             await show_history(update, context)
         else:
             await update.message.reply_text("La URL proporcionada no es válida. Inténtalo de nuevo.")
-        user_states.pop(user_id) 
+        await user_states.pop(user_id)
+
+    elif state == "waiting_for_import":
+        # También se aceptan las URLs pegadas como texto
+        await user_states.pop(user_id)
+        await start_import(update, context, user_input)
 
     else:
         await update.message.reply_text("Acción no reconocida. Por favor, utiliza el menú para empezar.")
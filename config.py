@@ -0,0 +1,126 @@
+# config.py
+import os
+
+from dotenv import load_dotenv
+
+# Cargar variables de entorno (.env) antes de leer la configuración
+load_dotenv()
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+# ----------------- MOTOR DE DESCARGAS -----------------
+# Número de workers concurrentes que procesan la cola de URLs
+FETCH_WORKERS = _env_int("FETCH_WORKERS", 20)
+# Máximo de peticiones simultáneas contra un mismo dominio
+FETCH_PER_HOST = _env_int("FETCH_PER_HOST", 4)
+# Peticiones por segundo permitidas en total (0 = sin límite)
+FETCH_RATE = _env_float("FETCH_RATE", 10.0)
+# Tiempo máximo de espera por petición, en segundos
+FETCH_TIMEOUT = _env_float("FETCH_TIMEOUT", 20.0)
+# Número máximo de URLs cuyos validadores HTTP (ETag / Last-Modified) se recuerdan
+VALIDATOR_CACHE_SIZE = _env_int("VALIDATOR_CACHE_SIZE", 50000)
+# Segundos durante los que se reutiliza el último resultado de un producto en las consultas
+# del bot (/checkprice, /add) y número máximo de productos guardados en memoria
+PRODUCT_CACHE_TTL = _env_float("PRODUCT_CACHE_TTL", 900.0)
+PRODUCT_CACHE_SIZE = _env_int("PRODUCT_CACHE_SIZE", 50000)
+# 1 = guardar también la caché de productos en SQLite para conservarla entre reinicios
+PRODUCT_CACHE_PERSIST = _env_int("PRODUCT_CACHE_PERSIST", 0)
+
+# ----------------- CONVERSACIONES -----------------
+# Dónde se guarda en qué paso del menú está cada usuario: "memory" o "sqlite"
+# ("sqlite" sobrevive a reinicios y se comparte entre procesos)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+# Segundos tras los que se olvida una conversación abandonada y máximo de conversaciones guardadas
+STATE_TTL = _env_float("STATE_TTL", 900.0)
+STATE_MAX_USERS = _env_int("STATE_MAX_USERS", 10000)
+
+# ----------------- MÉTRICAS -----------------
+# Puerto en el que el bot expone sus métricas en formato Prometheus (0 = desactivadas)
+METRICS_PORT = _env_int("METRICS_PORT", 0)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# ----------------- BASE DE DATOS -----------------
+# Hilos dedicados a ejecutar consultas para los manejadores asíncronos
+DB_WORKERS = _env_int("DB_WORKERS", 4)
+# Hilos para las consultas del planificador, los workers y las importaciones/exportaciones
+DB_BACKGROUND_WORKERS = _env_int("DB_BACKGROUND_WORKERS", 4)
+
+# ----------------- EXTRACCIÓN DE DATOS -----------------
+# Extractor rápido que se prueba antes de BeautifulSoup: "regex", "lxml" o "soup"
+PARSER_FAST_PATH = os.getenv("PARSER_FAST_PATH", "regex")
+# Procesos dedicados a parsear páginas durante el barrido (0 = parsear en un hilo)
+PARSE_WORKERS = _env_int("PARSE_WORKERS", max(1, (os.cpu_count() or 2) - 1))
+
+# ----------------- REINTENTOS -----------------
+# Intentos por URL durante el barrido y desde los comandos del bot
+RETRY_MAX_ATTEMPTS = _env_int("RETRY_MAX_ATTEMPTS", 4)
+INTERACTIVE_MAX_ATTEMPTS = _env_int("INTERACTIVE_MAX_ATTEMPTS", 2)
+# Espera base y máxima del backoff exponencial, en segundos
+RETRY_BASE_DELAY = _env_float("RETRY_BASE_DELAY", 1.0)
+RETRY_MAX_DELAY = _env_float("RETRY_MAX_DELAY", 60.0)
+# Reintentos permitidos por ventana del planificador (SCHEDULER_RESYNC), como fracción de las peticiones realizadas
+RETRY_BUDGET_RATIO = _env_float("RETRY_BUDGET_RATIO", 0.2)
+# Respuestas de bloqueo (429/503/captcha) seguidas que pausan un dominio, y duración de la pausa
+BREAKER_THRESHOLD = _env_int("BREAKER_THRESHOLD", 5)
+BREAKER_COOLDOWN = _env_float("BREAKER_COOLDOWN", 60.0)
+BREAKER_MAX_COOLDOWN = _env_float("BREAKER_MAX_COOLDOWN", 900.0)
+
+# ----------------- PLANIFICADOR -----------------
+# "adaptive": cada producto se revisa según lo que suele cambiar su precio;
+# "fixed": se revisan todos los productos cada CHECK_INTERVAL segundos;
+# "workers": el bot no revisa precios, lo hacen los procesos lanzados con --run-worker
+SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "adaptive")
+# Intervalo del modo fijo e intervalo inicial de los productos sin historial, en segundos
+CHECK_INTERVAL = _env_float("CHECK_INTERVAL", 3600.0)
+# Límites del intervalo adaptativo de cada producto, en segundos
+SCHEDULER_MIN_INTERVAL = _env_float("SCHEDULER_MIN_INTERVAL", 900.0)
+SCHEDULER_MAX_INTERVAL = _env_float("SCHEDULER_MAX_INTERVAL", 86400.0)
+# Peticiones por minuto que puede gastar el planificador en total
+# (0 = automático: según el número de productos y sus intervalos)
+SCHEDULER_RPM = _env_float("SCHEDULER_RPM", 0.0)
+# Lotes de productos que se revisan a la vez (un dominio lento no retrasa a los demás)
+SCHEDULER_CONCURRENCY = _env_int("SCHEDULER_CONCURRENCY", 8)
+# Cada cuántos segundos se vuelven a leer las suscripciones de la base de datos
+SCHEDULER_RESYNC = _env_float("SCHEDULER_RESYNC", 300.0)
+# Productos revisados entre dos puntos de control de un barrido completo
+SWEEP_CHECKPOINT = _env_int("SWEEP_CHECKPOINT", 200)
+
+# ----------------- WORKERS -----------------
+# Revisiones que reserva cada worker de una vez y segundos que dura la reserva
+# (si el worker se cae, pasado ese tiempo otro worker las retoma)
+WORKER_BATCH = _env_int("WORKER_BATCH", 50)
+WORKER_LEASE = _env_float("WORKER_LEASE", 300.0)
+# Cada cuántos segundos el bot busca avisos de los workers pendientes de enviar
+WORKER_POLL = _env_float("WORKER_POLL", 5.0)
+# Puerto de las métricas de cada worker (0 = desactivadas; distinto para cada worker de una máquina)
+WORKER_METRICS_PORT = _env_int("WORKER_METRICS_PORT", 0)
+
+# ----------------- NOTIFICACIONES -----------------
+# Mensajes por segundo en total (Telegram admite unos 30) y segundos mínimos entre mensajes a un mismo chat
+NOTIFY_RATE = _env_float("NOTIFY_RATE", 25.0)
+NOTIFY_CHAT_INTERVAL = _env_float("NOTIFY_CHAT_INTERVAL", 1.0)
+# Tareas que envían las notificaciones en paralelo
+NOTIFY_WORKERS = _env_int("NOTIFY_WORKERS", 4)
+
+# ----------------- GRÁFICAS -----------------
+# Procesos que dibujan las gráficas de /history (0 = dibujar en un hilo)
+CHART_WORKERS = _env_int("CHART_WORKERS", 1)
+# Número de gráficas ya dibujadas que se guardan en memoria
+CHART_CACHE_SIZE = _env_int("CHART_CACHE_SIZE", 256)
+# Tramos de tiempo en los que se agrupa el historial al leerlo, y puntos máximos que se dibujan
+HISTORY_BUCKETS = _env_int("HISTORY_BUCKETS", 1000)
+HISTORY_MAX_POINTS = _env_int("HISTORY_MAX_POINTS", 500)
+
+# ----------------- IMPORTACIÓN -----------------
+# Productos máximos por importación y tamaño máximo del archivo subido, en bytes
+IMPORT_MAX_ITEMS = _env_int("IMPORT_MAX_ITEMS", 1000)
+IMPORT_MAX_BYTES = _env_int("IMPORT_MAX_BYTES", 1_000_000)
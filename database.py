@@ -1,140 +1,1081 @@
 import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from prices import PriceStats, parse_price_text, price_from_row
+from utils import canonicalize_url, get_item_key
 
 # Nombre del archivo de la base de datos
 DB_NAME = "tracker.db"
 
-# Inicializar la base de datos
-def init_db():
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
+# Ajustes aplicados a cada conexión: WAL permite leer mientras se escribe y
+# synchronous=NORMAL evita un fsync por transacción (seguro en modo WAL)
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA busy_timeout=10000",
+)
+
+# Ventanas (en días) de los mínimos móviles de `price_stats`
+STATS_WINDOWS = (30, 90)
+
+# Tipos de regla de aviso de una suscripción. Sin reglas se avisa de cualquier cambio.
+#   any: cualquier cambio; target: el precio baja hasta `threshold` céntimos o menos;
+#   pct_drop: baja al menos un `threshold` % respecto al precio anterior;
+#   all_time_low: mínimo histórico; back_in_stock: vuelve a estar disponible
+ALERT_KINDS = ("any", "target", "pct_drop", "all_time_low", "back_in_stock")
+
+# Ids por consulta en los `IN (?, ...)`: por debajo del límite de variables de
+# SQLite (999 en versiones antiguas, 32766 en las actuales)
+SQL_CHUNK = 900
+
+# Una conexión persistente por hilo (sqlite3 no permite compartirlas entre hilos)
+_local = threading.local()
+
+# Trocear una lista de ids en bloques de SQL_CHUNK para los `IN (?, ...)`
+def _chunks(values, size=SQL_CHUNK):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+# Obtener la conexión del hilo actual, abriéndola la primera vez
+def get_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.db_name != DB_NAME:
+        if conn is not None:
+            conn.close()
+        # isolation_level=None: las transacciones se controlan con `transaction()`
+        conn = sqlite3.connect(DB_NAME, timeout=10, isolation_level=None)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        _local.conn = conn
+        _local.db_name = DB_NAME
+    return conn
+
+# Cerrar la conexión del hilo actual
+def close_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# Cursor para consultas de solo lectura
+@contextmanager
+def db_cursor():
+    cursor = get_connection().cursor()
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+
+# Ejecutar varias escrituras en una sola transacción (un único commit).
+# Las transacciones anidadas se integran en la exterior.
+@contextmanager
+def transaction():
+    conn = get_connection()
+    cursor = conn.cursor()
+    if conn.in_transaction:
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+        return
+
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        yield cursor
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+    finally:
+        cursor.close()
+
+# Crear las tablas del esquema normalizado
+def _create_tables(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY
+    )
+    """)
+    # Un registro por producto de Amazon, compartido por todos los usuarios
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        marketplace TEXT NOT NULL,
+        asin TEXT NOT NULL,
+        url TEXT NOT NULL,
+        name TEXT,
+        price_cents INTEGER,
+        currency TEXT,
+        availability TEXT,
+        last_change_at DATETIME,
+        UNIQUE (marketplace, asin)
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (user_id, item_id),
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (item_id) REFERENCES items(id)
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS price_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        item_id INTEGER,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        price_cents INTEGER,
+        currency TEXT,
+        availability TEXT,
+        FOREIGN KEY (item_id) REFERENCES items(id)
+    )
+    """)
+    # Barridos completos: permiten retomar uno interrumpido y consultar su duración
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sweeps (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        finished_at DATETIME,
+        last_item_id INTEGER NOT NULL DEFAULT 0,
+        items_checked INTEGER NOT NULL DEFAULT 0,
+        price_changes INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    # Estadísticas de cada producto, actualizadas en la misma transacción que el historial.
+    # Los mínimos móviles guardan cuándo dejan de ser válidos (NULL = el mínimo es el precio actual)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS price_stats (
+        item_id INTEGER PRIMARY KEY,
+        min_cents INTEGER,
+        min_at DATETIME,
+        max_cents INTEGER,
+        max_at DATETIME,
+        min_30d_cents INTEGER,
+        min_30d_expires DATETIME,
+        min_90d_cents INTEGER,
+        min_90d_expires DATETIME,
+        sum_cents INTEGER NOT NULL DEFAULT 0,
+        samples INTEGER NOT NULL DEFAULT 0,
+        last_change_at DATETIME,
+        FOREIGN KEY (item_id) REFERENCES items(id)
+    )
+    """)
+    # Reglas de aviso de cada suscripción (se cumplen si se cumple cualquiera de ellas)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS alert_rules (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        subscription_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        threshold REAL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (subscription_id, kind),
+        FOREIGN KEY (subscription_id) REFERENCES subscriptions(id)
+    )
+    """)
+    # Cola de revisiones compartida por los workers (--run-worker): una fila por producto
+    # seguido, con la hora de su próxima revisión y el worker que la tiene reservada
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS scrape_jobs (
+        item_id INTEGER PRIMARY KEY,
+        due_at REAL NOT NULL,
+        interval REAL NOT NULL,
+        lease_owner TEXT,
+        leased_until REAL,
+        FOREIGN KEY (item_id) REFERENCES items(id)
+    )
+    """)
+    # Avisos generados por los workers, pendientes de que el bot los envíe
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS notification_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        name TEXT,
+        url TEXT NOT NULL,
+        old_cents INTEGER,
+        old_currency TEXT,
+        old_availability TEXT,
+        new_cents INTEGER,
+        new_currency TEXT,
+        new_availability TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    # Paso del menú en el que está cada usuario (JSON) y hora a la que caduca
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS conversation_states (
+        user_id INTEGER PRIMARY KEY,
+        state TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """)
+    # Últimos resultados parseados por URL canónica (copia persistente de la caché de productos)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS product_cache (
+        url TEXT PRIMARY KEY,
+        name TEXT,
+        price_cents INTEGER,
+        currency TEXT,
+        availability TEXT,
+        fetched_at REAL NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_item_id ON subscriptions(item_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scrape_jobs_due_at ON scrape_jobs(due_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversation_states_expires_at ON conversation_states(expires_at)")
+    # (item_id, timestamp) sirve los historiales ya ordenados sin ordenar en memoria
+    cursor.execute("DROP INDEX IF EXISTS idx_price_history_item_id")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_price_history_item_timestamp ON price_history(item_id, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_price_history_item_price ON price_history(item_id, price_cents)")
+
+# Añadir las columnas nuevas a bases de datos creadas con versiones anteriores
+def _add_missing_columns(cursor):
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(items)")]
+    if "last_change_at" not in columns:
+        cursor.execute("ALTER TABLE items ADD COLUMN last_change_at DATETIME")
+        _refresh_last_prices(cursor)
+
+# Copiar a `items` el último precio registrado en el historial de cada producto
+def _refresh_last_prices(cursor):
+    cursor.execute("""
+    UPDATE items
+    SET (price_cents, currency, availability, last_change_at) = (
+        SELECT ph.price_cents, ph.currency, ph.availability, ph.timestamp
+        FROM price_history ph
+        WHERE ph.item_id = items.id
+        ORDER BY ph.timestamp DESC, ph.id DESC
+        LIMIT 1
+    )
+    WHERE EXISTS (SELECT 1 FROM price_history ph WHERE ph.item_id = items.id)
+    """)
+
+# Registrar cambios de precio: historial + último precio conocido en `items`
+def _insert_price_changes(cursor, changes):
+    rows = [(item_id, *_price_columns(price)) for item_id, price in changes]
+    cursor.executemany("""
+    INSERT INTO price_history (item_id, price_cents, currency, availability)
+    VALUES (?, ?, ?, ?)
+    """, rows)
+    cursor.executemany("""
+    UPDATE items
+    SET price_cents = ?, currency = ?, availability = ?, last_change_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+    """, [(*price, item_id) for item_id, *price in rows])
+    _update_price_stats(cursor, changes)
+
+def _shift(timestamp, days):
+    moved = datetime.fromisoformat(timestamp) + timedelta(days=days)
+    return moved.strftime("%Y-%m-%d %H:%M:%S")
+
+# Mínimo de los últimos `days` días y hasta cuándo es válido: (céntimos, caducidad o None).
+# Cuenta también el precio vigente al empezar la ventana (el último cambio anterior a ella).
+def _window_min(cursor, item_id, days, now):
+    start = _shift(now, -days)
+    cursor.execute("""
+    SELECT timestamp, price_cents FROM price_history
+    WHERE item_id = ? AND (timestamp >= ? OR id = (
+        SELECT id FROM price_history WHERE item_id = ? AND timestamp < ?
+        ORDER BY timestamp DESC, id DESC
+        LIMIT 1
+    ))
+    ORDER BY timestamp, id
+    """, (item_id, start, item_id, start))
+    rows = cursor.fetchall()
+
+    best = None
+    for index, (timestamp, amount) in enumerate(rows):
+        if amount is not None and (best is None or amount <= rows[best][1]):
+            best = index
+    if best is None:
+        return None, None
+    # El mínimo deja de contar `days` días después de que lo sustituya el siguiente cambio
+    expires = _shift(rows[best + 1][0], days) if best + 1 < len(rows) else None
+    return rows[best][1], expires
+
+# Recalcular desde el historial las estadísticas de un producto
+def _refresh_price_stats(cursor, item_id, now):
+    cursor.execute("""
+    SELECT MIN(price_cents), MAX(price_cents), COALESCE(SUM(price_cents), 0), COUNT(price_cents), MAX(timestamp)
+    FROM price_history WHERE item_id = ?
+    """, (item_id,))
+    min_cents, max_cents, sum_cents, samples, last_change_at = cursor.fetchone()
+    cursor.execute("""
+    SELECT
+        (SELECT MAX(timestamp) FROM price_history WHERE item_id = ? AND price_cents = ?),
+        (SELECT MAX(timestamp) FROM price_history WHERE item_id = ? AND price_cents = ?)
+    """, (item_id, min_cents, item_id, max_cents))
+    min_at, max_at = cursor.fetchone()
+    windows = [value for days in STATS_WINDOWS for value in _window_min(cursor, item_id, days, now)]
+    cursor.execute("""
+    INSERT OR REPLACE INTO price_stats (
+        item_id, min_cents, min_at, max_cents, max_at,
+        min_30d_cents, min_30d_expires, min_90d_cents, min_90d_expires,
+        sum_cents, samples, last_change_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (item_id, min_cents, min_at, max_cents, max_at, *windows, sum_cents, samples, last_change_at))
+
+# Recalcular solo los mínimos móviles de un producto (cuando han caducado)
+def _refresh_window_stats(cursor, item_id, now):
+    windows = [value for days in STATS_WINDOWS for value in _window_min(cursor, item_id, days, now)]
+    cursor.execute("""
+    UPDATE price_stats
+    SET min_30d_cents = ?, min_30d_expires = ?, min_90d_cents = ?, min_90d_expires = ?
+    WHERE item_id = ?
+    """, (*windows, item_id))
+
+# Actualizar las estadísticas tras registrar cambios de precio (ya insertados en el historial),
+# sin recorrer el historial salvo cuando caduca un mínimo móvil
+def _update_price_stats(cursor, changes):
+    now = cursor.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+    for item_id, price in changes:
         cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY
-        )
-        """)
+        SELECT min_cents, min_at, max_cents, max_at,
+               min_30d_cents, min_30d_expires, min_90d_cents, min_90d_expires, sum_cents, samples
+        FROM price_stats WHERE item_id = ?
+        """, (item_id,))
+        row = cursor.fetchone()
+        if row is None:
+            _refresh_price_stats(cursor, item_id, now)
+            continue
+
+        min_cents, min_at, max_cents, max_at, *windows, sum_cents, samples = row
+        amount = price.amount if price is not None else None
+        if amount is not None:
+            if min_cents is None or amount <= min_cents:
+                min_cents, min_at = amount, now
+            if max_cents is None or amount >= max_cents:
+                max_cents, max_at = amount, now
+            sum_cents += amount
+            samples += 1
+
+        for index, days in enumerate(STATS_WINDOWS):
+            window_min, expires = windows[2 * index], windows[2 * index + 1]
+            if expires is not None and expires <= now:
+                window_min, expires = _window_min(cursor, item_id, days, now)
+            elif amount is not None and (window_min is None or amount <= window_min):
+                window_min, expires = amount, None
+            elif expires is None and window_min is not None:
+                # El mínimo ya no es el precio vigente: seguirá contando `days` días más
+                expires = _shift(now, days)
+            windows[2 * index], windows[2 * index + 1] = window_min, expires
+
         cursor.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            url TEXT NOT NULL,
-            name TEXT,
-            price TEXT,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        )
-        """)
+        UPDATE price_stats
+        SET min_cents = ?, min_at = ?, max_cents = ?, max_at = ?,
+            min_30d_cents = ?, min_30d_expires = ?, min_90d_cents = ?, min_90d_expires = ?,
+            sum_cents = ?, samples = ?, last_change_at = ?
+        WHERE item_id = ?
+        """, (min_cents, min_at, max_cents, max_at, *windows, sum_cents, samples, now, item_id))
+
+# Calcular las estadísticas de los productos con historial que aún no las tienen
+def _backfill_price_stats(cursor):
+    item_ids = [row[0] for row in cursor.execute("""
+    SELECT DISTINCT item_id FROM price_history
+    WHERE item_id NOT IN (SELECT item_id FROM price_stats)
+    """).fetchall()]
+    if item_ids:
+        now = cursor.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+        for item_id in item_ids:
+            _refresh_price_stats(cursor, item_id, now)
+
+# Columnas (price_cents, currency, availability) de un `Price`
+def _price_columns(price):
+    if price is None:
+        return None, None, None
+    return price.amount, price.currency, price.availability.value
+
+# Insertar un producto (o actualizar sus datos si ya existe) y devolver su id
+def _upsert_item(cursor, url, name=None, price=None):
+    url = canonicalize_url(url)
+    marketplace, asin = get_item_key(url)
+    cursor.execute("""
+    INSERT INTO items (marketplace, asin, url, name, price_cents, currency, availability)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (marketplace, asin) DO UPDATE SET
+        name = COALESCE(excluded.name, items.name),
+        price_cents = CASE WHEN excluded.availability IS NULL
+                           THEN items.price_cents ELSE excluded.price_cents END,
+        currency = COALESCE(excluded.currency, items.currency),
+        availability = COALESCE(excluded.availability, items.availability)
+    """, (marketplace, asin, url, name, *_price_columns(price)))
+    cursor.execute("SELECT id FROM items WHERE marketplace = ? AND asin = ?", (marketplace, asin))
+    return cursor.fetchone()[0]
+
+# Migrar bases de datos antiguas (products + price_history por usuario)
+def _migrate_legacy_schema(cursor):
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(products)")]
+    if "user_id" not in columns:
+        return
+
+    legacy_products = cursor.execute("""
+    SELECT id, user_id, url, name, price FROM products ORDER BY id
+    """).fetchall()
+    legacy_history = cursor.execute("""
+    SELECT product_id, timestamp, price FROM price_history ORDER BY timestamp, id
+    """).fetchall()
+    cursor.execute("DROP TABLE price_history")
+    cursor.execute("DROP TABLE products")
+    _create_tables(cursor)
+
+    item_ids = {}
+    for product_id, user_id, url, name, price in legacy_products:
+        item_id = _upsert_item(cursor, url, name, parse_price_text(price) if price else None)
+        item_ids[product_id] = item_id
+        cursor.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
         cursor.execute("""
-        CREATE TABLE IF NOT EXISTS price_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            product_id INTEGER,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            price TEXT,
-            FOREIGN KEY (product_id) REFERENCES products(id)
-        )
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_id ON price_history(product_id)")
-        conn.commit()
+        INSERT OR IGNORE INTO subscriptions (user_id, item_id) VALUES (?, ?)
+        """, (user_id, item_id))
+
+    # Fusionar los historiales duplicados de cada suscriptor: solo se conservan los cambios reales
+    last_prices = {}
+    for product_id, timestamp, price in legacy_history:
+        item_id = item_ids.get(product_id)
+        if item_id is None or (item_id in last_prices and last_prices[item_id] == price):
+            continue
+        last_prices[item_id] = price
+        cursor.execute("""
+        INSERT INTO price_history (item_id, timestamp, price_cents, currency, availability)
+        VALUES (?, ?, ?, ?, ?)
+        """, (item_id, timestamp, *_price_columns(parse_price_text(price))))
+    _refresh_last_prices(cursor)
+
+# Migrar los precios guardados como texto ("1234,99 €") a céntimos + divisa + disponibilidad
+def _migrate_text_prices(cursor):
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(items)")]
+    if "price" not in columns:
+        return
+
+    items = cursor.execute("SELECT id, marketplace, asin, url, name, price FROM items").fetchall()
+    history = cursor.execute("SELECT id, item_id, timestamp, price FROM price_history").fetchall()
+    cursor.execute("DROP TABLE price_history")
+    cursor.execute("DROP TABLE items")
+    _create_tables(cursor)
+
+    cursor.executemany("""
+    INSERT INTO items (id, marketplace, asin, url, name, price_cents, currency, availability)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (item_id, marketplace, asin, url, name,
+         *_price_columns(parse_price_text(price) if price else None))
+        for item_id, marketplace, asin, url, name, price in items
+    ])
+    cursor.executemany("""
+    INSERT INTO price_history (id, item_id, timestamp, price_cents, currency, availability)
+    VALUES (?, ?, ?, ?, ?, ?)
+    """, [
+        (row_id, item_id, timestamp, *_price_columns(parse_price_text(price)))
+        for row_id, item_id, timestamp, price in history
+    ])
+    _refresh_last_prices(cursor)
+
+# Inicializar la base de datos
+def init_db():
+    with transaction() as cursor:
+        _migrate_legacy_schema(cursor)
+        _migrate_text_prices(cursor)
+        _create_tables(cursor)
+        _add_missing_columns(cursor)
+        _backfill_price_stats(cursor)
 
 # Añadir un usuario
 def add_user(user_id):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
+    with transaction() as cursor:
         cursor.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
-        conn.commit()
 
-# Añadir un producto
+# Añadir un producto a la lista de un usuario y devolver el id del producto.
+# Si se conoce su precio y es nuevo, se registra en el historial.
 def add_product(user_id, url, name=None, price=None):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
+    with transaction() as cursor:
+        item_id = _upsert_item(cursor, url, name)
         cursor.execute("""
-        INSERT INTO products (user_id, url, name, price)
-        VALUES (?, ?, ?, ?)
-        """, (user_id, url, name, price))
-        conn.commit()
+        INSERT OR IGNORE INTO subscriptions (user_id, item_id)
+        VALUES (?, ?)
+        """, (user_id, item_id))
+        if price is not None and _get_last_price(cursor, item_id) != price:
+            _insert_price_changes(cursor, [(item_id, price)])
+        return item_id
+
+# Añadir de una vez varios productos a la lista de un usuario, en una sola transacción.
+# Devuelve (número de productos nuevos en la lista, pares (item_id, URL) de los que aún no
+# se han descargado nunca), para resolver estos últimos en segundo plano.
+def add_products(user_id, urls):
+    with transaction() as cursor:
+        cursor.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+        added, pending = 0, []
+        for url in urls:
+            item_id = _upsert_item(cursor, url)
+            cursor.execute("""
+            INSERT OR IGNORE INTO subscriptions (user_id, item_id)
+            VALUES (?, ?)
+            """, (user_id, item_id))
+            if cursor.rowcount:
+                added += 1
+                if _get_last_price(cursor, item_id) is None:
+                    pending.append((item_id, canonicalize_url(url)))
+        return added, pending
+
+# Guardar el nombre y el precio descargados de varios productos: tuplas (item_id, nombre, Price).
+# El precio solo se registra en el historial si es nuevo.
+def update_items_info(rows):
+    with transaction() as cursor:
+        cursor.executemany("""
+        UPDATE items SET name = COALESCE(?, name) WHERE id = ?
+        """, [(name, item_id) for item_id, name, price in rows])
+        changes = [
+            (item_id, price) for item_id, name, price in rows
+            if price is not None and _get_last_price(cursor, item_id) != price
+        ]
+        _insert_price_changes(cursor, changes)
+
+# Recorrer los productos de un usuario y su historial sin cargarlo entero en memoria:
+# genera filas (url, nombre, timestamp, céntimos, divisa, disponibilidad). Los productos sin
+# historial aparecen una vez con timestamp None. Debe consumirse en el mismo hilo.
+def iter_user_history(user_id, batch_size=1000):
+    with db_cursor() as cursor:
+        cursor.execute("""
+        SELECT i.url, i.name, ph.timestamp, ph.price_cents, ph.currency, ph.availability
+        FROM subscriptions s
+        JOIN items i ON s.item_id = i.id
+        LEFT JOIN price_history ph ON ph.item_id = i.id
+        WHERE s.user_id = ?
+        ORDER BY s.id, ph.timestamp, ph.id
+        """, (user_id,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
 
 # Obtener los productos de un usuario
 def get_products(user_id):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
+    with db_cursor() as cursor:
         cursor.execute("""
-        SELECT url, name, price FROM products WHERE user_id = ?
+        SELECT i.url, i.name, i.price_cents, i.currency, i.availability
+        FROM subscriptions s
+        JOIN items i ON s.item_id = i.id
+        WHERE s.user_id = ?
+        ORDER BY s.id
         """, (user_id,))
-        return cursor.fetchall()
+        return [(url, name, price_from_row(*price)) for url, name, *price in cursor.fetchall()]
 
-# Eliminar un producto
+# Eliminar un producto de la lista de un usuario
 def remove_product(user_id, url):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
+    with transaction() as cursor:
         cursor.execute("""
-        DELETE FROM products WHERE user_id = ? AND url = ?
-        """, (user_id, url))
-        conn.commit()
+        DELETE FROM alert_rules
+        WHERE subscription_id = (
+            SELECT s.id FROM subscriptions s
+            JOIN items i ON s.item_id = i.id
+            WHERE s.user_id = ? AND i.marketplace = ? AND i.asin = ?
+        )
+        """, (user_id, *get_item_key(url)))
+        cursor.execute("""
+        DELETE FROM subscriptions
+        WHERE user_id = ? AND item_id = (
+            SELECT id FROM items WHERE marketplace = ? AND asin = ?
+        )
+        """, (user_id, *get_item_key(url)))
+
 
-def record_price_change(product_id, price):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
+# Historial de precios de un producto de un usuario, opcionalmente solo a partir de `since`
+def get_price_history(user_id, url, since=""):
+    with db_cursor() as cursor:
         cursor.execute("""
-        INSERT INTO price_history (product_id, price)
-        VALUES (?, ?)
-        """, (product_id, price))
-        conn.commit()
+        SELECT timestamp, price_cents, currency, availability
+        FROM price_history
+        WHERE item_id = (
+            SELECT i.id
+            FROM items i
+            JOIN subscriptions s ON s.item_id = i.id
+            WHERE s.user_id = ? AND i.marketplace = ? AND i.asin = ?
+        )
+        AND timestamp >= ?
+        ORDER BY timestamp ASC
+        """, (user_id, *get_item_key(url), since))
+        return [(timestamp, price_from_row(*price)) for timestamp, *price in cursor.fetchall()]
 
+# Historial de precios reducido para dibujarlo: solo los puntos con precio a partir de
+# `since` ("AAAA-MM-DD HH:MM:SS", UTC), repartidos en `buckets` tramos de tiempo de los que
+# se conservan el precio mínimo, el máximo y el último. Como mucho devuelve 3 * (buckets + 1)
+# puntos, sea cual sea la longitud del historial.
+def get_price_history_points(user_id, url, since="", buckets=1000):
+    with db_cursor() as cursor:
+        cursor.execute("""
+        WITH history AS (
+            SELECT ph.timestamp, ph.price_cents, ph.currency, ph.availability
+            FROM price_history ph
+            WHERE ph.item_id = (
+                SELECT i.id
+                FROM items i
+                JOIN subscriptions s ON s.item_id = i.id
+                WHERE s.user_id = ? AND i.marketplace = ? AND i.asin = ?
+            )
+            AND ph.timestamp >= ? AND ph.price_cents IS NOT NULL
+        ),
+        bounds AS (
+            SELECT julianday(MIN(timestamp)) AS start,
+                   (julianday(MAX(timestamp)) - julianday(MIN(timestamp))) / ? + 1e-9 AS width
+            FROM history
+        ),
+        bucketed AS MATERIALIZED (
+            SELECT history.*, CAST((julianday(timestamp) - bounds.start) / bounds.width AS INTEGER) AS bucket
+            FROM history, bounds
+        )
+        -- Con MIN()/MAX() SQLite devuelve las demás columnas de la fila elegida
+        SELECT timestamp, price_cents, currency, availability FROM (
+            SELECT timestamp, MIN(price_cents) AS price_cents, currency, availability FROM bucketed GROUP BY bucket
+            UNION
+            SELECT timestamp, MAX(price_cents), currency, availability FROM bucketed GROUP BY bucket
+            UNION
+            SELECT MAX(timestamp), price_cents, currency, availability FROM bucketed GROUP BY bucket
+        )
+        ORDER BY timestamp
+        """, (user_id, *get_item_key(url), since, max(1, buckets)))
+        return [(timestamp, price_from_row(*price)) for timestamp, *price in cursor.fetchall()]
+
+# Clave de la versión actual del historial de un producto de un usuario: (item_id, último timestamp)
+def get_history_key(user_id, url):
+    with db_cursor() as cursor:
+        cursor.execute("""
+        SELECT i.id, (SELECT MAX(ph.timestamp) FROM price_history ph WHERE ph.item_id = i.id)
+        FROM items i
+        JOIN subscriptions s ON s.item_id = i.id
+        WHERE s.user_id = ? AND i.marketplace = ? AND i.asin = ?
+        """, (user_id, *get_item_key(url)))
+        return cursor.fetchone()
+
+# Datos guardados de un producto: (item_id, nombre, Price), o None si no existe
+def get_item_info(url):
+    with db_cursor() as cursor:
+        cursor.execute("""
+        SELECT id, name, price_cents, currency, availability
+        FROM items WHERE marketplace = ? AND asin = ?
+        """, get_item_key(url))
+        result = cursor.fetchone()
+        if result is None:
+            return None
+        item_id, name, *price = result
+        return item_id, name, price_from_row(*price)
+
+# Guardar resultados parseados en la caché persistente: filas (url, nombre, Price, fetched_at).
+# Las entradas anteriores a `expired_before` se borran en la misma transacción
+def save_cached_products(rows, expired_before=0):
+    with transaction() as cursor:
+        cursor.executemany("""
+        INSERT INTO product_cache (url, name, price_cents, currency, availability, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (url) DO UPDATE SET
+            name = excluded.name, price_cents = excluded.price_cents, currency = excluded.currency,
+            availability = excluded.availability, fetched_at = excluded.fetched_at
+        WHERE excluded.fetched_at >= product_cache.fetched_at
+        """, [
+            (url, name, price.amount, price.currency, price.availability.value, fetched_at)
+            for url, name, price, fetched_at in rows
+        ])
+        cursor.execute("DELETE FROM product_cache WHERE fetched_at < ?", (expired_before,))
+
+# Resultado guardado de una URL canónica si es posterior a `since`: (nombre, Price, fetched_at) o None
+def get_cached_product(url, since=0):
+    with db_cursor() as cursor:
+        cursor.execute("""
+        SELECT name, price_cents, currency, availability, fetched_at
+        FROM product_cache WHERE url = ? AND fetched_at >= ?
+        """, (url, since))
+        result = cursor.fetchone()
+        if result is None:
+            return None
+        name, *price, fetched_at = result
+        return name, price_from_row(*price), fetched_at
+
+def _get_last_price(cursor, item_id):
+    cursor.execute("""
+    SELECT price_cents, currency, availability FROM items WHERE id = ?
+    """, (item_id,))
+    result = cursor.fetchone()
+    return price_from_row(*result) if result else None
+
+# Último precio conocido de un producto (mantenido en `items`, sin recorrer el historial)
+def get_last_price(item_id):
+    with db_cursor() as cursor:
+        return _get_last_price(cursor, item_id)
 
-def get_price_history(user_id, url):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
+# Últimos precios de todos los productos seguidos (o solo de `item_ids`, consultados
+# en bloques de SQL_CHUNK): {item_id: Price}
+def get_price_snapshot(item_ids=None):
+    with db_cursor() as cursor:
+        if item_ids is None:
+            cursor.execute("""
+            SELECT id, price_cents, currency, availability
+            FROM items
+            WHERE EXISTS (SELECT 1 FROM subscriptions s WHERE s.item_id = items.id)
+            """)
+            rows = cursor.fetchall()
+        else:
+            rows = []
+            for chunk in _chunks(list(item_ids)):
+                cursor.execute(f"""
+                SELECT id, price_cents, currency, availability
+                FROM items
+                WHERE id IN ({", ".join("?" * len(chunk))})
+                """, chunk)
+                rows.extend(cursor.fetchall())
+        return {item_id: price_from_row(*price) for item_id, *price in rows}
+
+# Frecuencia de cambio de los productos seguidos, a partir del historial:
+# {item_id: (número de cambios registrados, segundos entre el primero y el último)}
+def get_change_frequencies():
+    with db_cursor() as cursor:
         cursor.execute("""
-        SELECT ph.timestamp, ph.price
+        SELECT ph.item_id, COUNT(*),
+               (julianday(MAX(ph.timestamp)) - julianday(MIN(ph.timestamp))) * 86400
         FROM price_history ph
-        JOIN products p ON ph.product_id = p.id
-        WHERE p.user_id = ? AND p.url = ?
-        ORDER BY ph.timestamp ASC
-        """, (user_id, url))
+        WHERE EXISTS (SELECT 1 FROM subscriptions s WHERE s.item_id = ph.item_id)
+        GROUP BY ph.item_id
+        """)
+        return {item_id: (changes, span or 0.0) for item_id, changes, span in cursor.fetchall()}
+
+
+# Obtener los productos seguidos por algún usuario, con cada suscriptor
+# (solo los de id mayor que `after_item_id`, para retomar un barrido)
+def get_all_products(after_item_id=0):
+    with db_cursor() as cursor:
+        cursor.execute("""
+        SELECT i.id, s.user_id, i.url, i.name
+        FROM items i
+        JOIN subscriptions s ON s.item_id = i.id
+        WHERE i.id > ?
+        ORDER BY i.id
+        """, (after_item_id,))
         return cursor.fetchall()
 
-def get_product_id(user_id, url):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
+def update_product_price(item_id, new_price):
+    # Actualizar el precio del producto
+    with transaction() as cursor:
+        # Actualizamos el precio en la tabla `items`
+        cursor.execute("""
+        UPDATE items
+        SET price_cents = ?, currency = ?, availability = ?, last_change_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        """, (*_price_columns(new_price), item_id))
+
+# Guardar en una sola transacción los cambios de precio de un barrido: pares (item_id, Price)
+def record_price_changes(changes):
+    with transaction() as cursor:
+        _insert_price_changes(cursor, changes)
+
+# Empezar un barrido completo o retomar el último si quedó a medias: (sweep_id, último item_id revisado)
+def start_sweep():
+    with transaction() as cursor:
         cursor.execute("""
-        SELECT id FROM products WHERE user_id = ? AND url = ?
-        """, (user_id, url))
+        SELECT id, last_item_id FROM sweeps
+        WHERE finished_at IS NULL
+        ORDER BY id DESC
+        LIMIT 1
+        """)
         result = cursor.fetchone()
-        return result[0] if result else None
+        if result:
+            return result
+        cursor.execute("INSERT INTO sweeps DEFAULT VALUES")
+        return cursor.lastrowid, 0
 
-def get_last_price(product_id):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
+# Guardar el progreso de un barrido tras revisar un bloque de productos
+def checkpoint_sweep(sweep_id, last_item_id, items_checked, price_changes):
+    with transaction() as cursor:
         cursor.execute("""
-        SELECT price
-        FROM price_history
-        WHERE product_id = ?
-        ORDER BY timestamp DESC
+        UPDATE sweeps
+        SET last_item_id = ?,
+            items_checked = items_checked + ?,
+            price_changes = price_changes + ?
+        WHERE id = ?
+        """, (last_item_id, items_checked, price_changes, sweep_id))
+
+# Marcar un barrido como terminado
+def finish_sweep(sweep_id):
+    with transaction() as cursor:
+        cursor.execute("UPDATE sweeps SET finished_at = CURRENT_TIMESTAMP WHERE id = ?", (sweep_id,))
+
+# Datos del último barrido terminado, o None: (inicio y fin en segundos Unix,
+# duración en segundos, productos revisados, cambios)
+def get_last_sweep():
+    with db_cursor() as cursor:
+        cursor.execute("""
+        SELECT CAST(strftime('%s', started_at) AS INTEGER),
+               CAST(strftime('%s', finished_at) AS INTEGER),
+               (julianday(finished_at) - julianday(started_at)) * 86400,
+               items_checked, price_changes
+        FROM sweeps
+        WHERE finished_at IS NOT NULL
+        ORDER BY id DESC
         LIMIT 1
-        """, (product_id,))
+        """)
+        return cursor.fetchone()
+
+# ----------------- CONVERSACIONES -----------------
+# Estado (JSON) de la conversación de un usuario si no ha caducado, o None
+def get_conversation_state(user_id, now):
+    with db_cursor() as cursor:
+        cursor.execute("""
+        SELECT state FROM conversation_states WHERE user_id = ? AND expires_at >= ?
+        """, (user_id, now))
         result = cursor.fetchone()
         return result[0] if result else None
 
+# Guardar el estado (JSON) de la conversación de un usuario hasta `expires_at`. De paso se
+# borran las conversaciones caducadas y, si hay más de `max_entries`, las más antiguas
+def set_conversation_state(user_id, state, expires_at, now, max_entries):
+    with transaction() as cursor:
+        cursor.execute("""
+        INSERT INTO conversation_states (user_id, state, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at
+        """, (user_id, state, expires_at))
+        cursor.execute("DELETE FROM conversation_states WHERE expires_at < ?", (now,))
+        cursor.execute("""
+        DELETE FROM conversation_states WHERE user_id IN (
+            SELECT user_id FROM conversation_states ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+        )
+        """, (max_entries,))
+
+# Olvidar la conversación de un usuario
+def delete_conversation_state(user_id):
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM conversation_states WHERE user_id = ?", (user_id,))
 
-def get_all_products():
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
+# ----------------- COLA DE REVISIONES (WORKERS) -----------------
+# Productos seguidos que aún no tienen fila en `scrape_jobs`; borra de paso las filas de
+# productos que ya nadie sigue
+def get_unscheduled_items():
+    with transaction() as cursor:
         cursor.execute("""
-        SELECT id, user_id, url, name
-        FROM products
+        DELETE FROM scrape_jobs
+        WHERE NOT EXISTS (SELECT 1 FROM subscriptions s WHERE s.item_id = scrape_jobs.item_id)
         """)
-        return cursor.fetchall()
-    
-def update_product_price(product_id, new_price):
-    # Actualizar el precio del producto
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        
-        # Actualizamos el precio en la tabla `products`
         cursor.execute("""
-        UPDATE products
-        SET price = ?
-        WHERE id = ?
-        """, (new_price, product_id))
-        conn.commit()
+        SELECT DISTINCT s.item_id FROM subscriptions s
+        WHERE NOT EXISTS (SELECT 1 FROM scrape_jobs j WHERE j.item_id = s.item_id)
+        """)
+        return [item_id for item_id, in cursor.fetchall()]
+
+# Programar productos nuevos: filas (item_id, due_at, intervalo). Si otro worker ya los
+# programó, se mantiene su fila
+def add_scrape_jobs(jobs):
+    with transaction() as cursor:
+        cursor.executemany("""
+        INSERT OR IGNORE INTO scrape_jobs (item_id, due_at, interval) VALUES (?, ?, ?)
+        """, jobs)
+
+# Reservar para `owner` hasta `limit` revisiones vencidas durante `lease` segundos.
+# Las reservas caducadas (worker caído) vuelven a estar disponibles.
+# Devuelve [(item_id, URL, hora prevista, intervalo)]
+def lease_scrape_jobs(owner, limit, lease, now):
+    with transaction() as cursor:
+        cursor.execute("""
+        UPDATE scrape_jobs SET lease_owner = ?, leased_until = ?
+        WHERE item_id IN (
+            SELECT item_id FROM scrape_jobs
+            WHERE due_at <= ? AND (leased_until IS NULL OR leased_until < ?)
+            ORDER BY due_at
+            LIMIT ?
+        )
+        RETURNING item_id
+        """, (owner, now + lease, now, now, limit))
+        item_ids = [item_id for item_id, in cursor.fetchall()]
+        jobs = []
+        for chunk in _chunks(item_ids):
+            cursor.execute(f"""
+            SELECT j.item_id, i.url, j.due_at, j.interval
+            FROM scrape_jobs j JOIN items i ON i.id = j.item_id
+            WHERE j.item_id IN ({", ".join("?" * len(chunk))})
+            """, chunk)
+            jobs.extend(cursor.fetchall())
+        return sorted(jobs, key=lambda job: job[2])
+
+# Liberar las revisiones terminadas y programar la siguiente: filas (item_id, due_at, intervalo).
+# Solo se actualizan las que siguen reservadas por `owner`
+def complete_scrape_jobs(owner, jobs):
+    with transaction() as cursor:
+        cursor.executemany("""
+        UPDATE scrape_jobs SET due_at = ?, interval = ?, lease_owner = NULL, leased_until = NULL
+        WHERE item_id = ? AND lease_owner = ?
+        """, [(due_at, interval, item_id, owner) for item_id, due_at, interval in jobs])
+
+# Hora de la próxima revisión que se puede reservar, o None si no hay ninguna
+def get_next_job_due(now):
+    with db_cursor() as cursor:
+        cursor.execute("""
+        SELECT MIN(CASE WHEN leased_until IS NOT NULL AND leased_until >= ? THEN leased_until ELSE due_at END)
+        FROM scrape_jobs
+        """, (now,))
+        return cursor.fetchone()[0]
+
+# Carga de la cola de revisiones: (productos programados, revisiones por minuto
+# que piden sus intervalos actuales)
+def get_scrape_demand():
+    with db_cursor() as cursor:
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(60.0 / interval), 0) FROM scrape_jobs")
+        return cursor.fetchone()
+
+# Guardar avisos para que los envíe el bot: filas (user_id, item_id, nombre, URL, Price anterior, Price nuevo)
+def queue_notifications(rows):
+    with transaction() as cursor:
+        cursor.executemany("""
+        INSERT INTO notification_outbox (
+            user_id, item_id, name, url, old_cents, old_currency, old_availability,
+            new_cents, new_currency, new_availability
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (user_id, item_id, name, url, *_price_columns(old), *_price_columns(new))
+            for user_id, item_id, name, url, old, new in rows
+        ])
+
+# Avisos pendientes más antiguos: [(id, user_id, item_id, nombre, URL, Price anterior, Price nuevo)]
+def get_queued_notifications(limit=500):
+    with db_cursor() as cursor:
+        cursor.execute("""
+        SELECT id, user_id, item_id, name, url, old_cents, old_currency, old_availability,
+               new_cents, new_currency, new_availability
+        FROM notification_outbox
+        ORDER BY id
+        LIMIT ?
+        """, (limit,))
+        return [
+            (row_id, user_id, item_id, name, url, price_from_row(*prices[:3]), price_from_row(*prices[3:]))
+            for row_id, user_id, item_id, name, url, *prices in cursor.fetchall()
+        ]
+
+# Borrar los avisos ya entregados al notificador
+def delete_notifications(ids):
+    with transaction() as cursor:
+        cursor.executemany("DELETE FROM notification_outbox WHERE id = ?", [(row_id,) for row_id in ids])
 
+# Estadísticas de precio de varios productos en O(1) cada uno: {item_id: PriceStats}.
+# Los mínimos móviles caducados se recalculan antes de devolverlos.
+def get_price_stats(item_ids):
+    item_ids = list(item_ids)
+    if not item_ids:
+        return {}
 
+    def fetch(cursor):
+        rows = []
+        for chunk in _chunks(item_ids):
+            rows.extend(cursor.execute(f"""
+            SELECT ps.item_id, i.currency, ps.min_cents, ps.min_at, ps.max_cents, ps.max_at,
+                   ps.min_30d_cents, ps.min_30d_expires, ps.min_90d_cents, ps.min_90d_expires,
+                   ps.sum_cents, ps.samples, ps.last_change_at
+            FROM price_stats ps
+            JOIN items i ON i.id = ps.item_id
+            WHERE ps.item_id IN ({", ".join("?" * len(chunk))})
+            """, chunk).fetchall())
+        return rows
 
+    with db_cursor() as cursor:
+        now = cursor.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+        rows = fetch(cursor)
+
+    stale = [row[0] for row in rows if any(expires and expires <= now for expires in (row[7], row[9]))]
+    if stale:
+        with transaction() as cursor:
+            for item_id in stale:
+                _refresh_window_stats(cursor, item_id, now)
+            rows = fetch(cursor)
+
+    return {
+        item_id: PriceStats(
+            currency, min_cents, min_at, max_cents, max_at, min_30d, min_90d,
+            round(sum_cents / samples) if samples else None, samples, last_change_at,
+        )
+        for (item_id, currency, min_cents, min_at, max_cents, max_at,
+             min_30d, _, min_90d, _, sum_cents, samples, last_change_at) in rows
+    }
+
+# Crear o actualizar una regla de aviso de la suscripción de un usuario a un producto.
+# Devuelve False si el usuario no sigue el producto.
+def set_alert_rule(user_id, url, kind, threshold=None):
+    if kind not in ALERT_KINDS:
+        raise ValueError(f"Tipo de regla desconocido: {kind}")
+    with transaction() as cursor:
+        cursor.execute("""
+        INSERT INTO alert_rules (subscription_id, kind, threshold)
+        SELECT s.id, ?, ?
+        FROM subscriptions s
+        JOIN items i ON s.item_id = i.id
+        WHERE s.user_id = ? AND i.marketplace = ? AND i.asin = ?
+        ON CONFLICT (subscription_id, kind) DO UPDATE SET threshold = excluded.threshold
+        """, (kind, threshold, user_id, *get_item_key(url)))
+        return cursor.rowcount > 0
+
+# Eliminar las reglas de aviso de una suscripción (se vuelve a avisar de cualquier cambio)
+def clear_alert_rules(user_id, url):
+    with transaction() as cursor:
+        cursor.execute("""
+        DELETE FROM alert_rules
+        WHERE subscription_id = (
+            SELECT s.id FROM subscriptions s
+            JOIN items i ON s.item_id = i.id
+            WHERE s.user_id = ? AND i.marketplace = ? AND i.asin = ?
+        )
+        """, (user_id, *get_item_key(url)))
+
+# Reglas de aviso de la suscripción de un usuario a un producto: [(kind, threshold)]
+def get_alert_rules(user_id, url):
+    with db_cursor() as cursor:
+        cursor.execute("""
+        SELECT r.kind, r.threshold
+        FROM alert_rules r
+        JOIN subscriptions s ON r.subscription_id = s.id
+        JOIN items i ON s.item_id = i.id
+        WHERE s.user_id = ? AND i.marketplace = ? AND i.asin = ?
+        ORDER BY r.id
+        """, (user_id, *get_item_key(url)))
+        return cursor.fetchall()
+
+# Evaluar de una vez las reglas de aviso de todos los suscriptores de los productos que han
+# cambiado en un barrido. `changes` son tuplas (item_id, Price anterior, Price nuevo) ya
+# registradas (las estadísticas incluyen el precio nuevo). Devuelve los pares (user_id, item_id)
+# que deben recibir aviso.
+def match_alert_rules(changes):
+    if not changes:
+        return []
+    cursor = get_connection().cursor()
+    try:
+        cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS sweep_changes (
+            item_id INTEGER PRIMARY KEY,
+            old_cents INTEGER,
+            old_availability TEXT,
+            new_cents INTEGER,
+            new_availability TEXT
+        )
+        """)
+        cursor.execute("DELETE FROM temp.sweep_changes")
+        cursor.executemany("""
+        INSERT OR REPLACE INTO temp.sweep_changes VALUES (?, ?, ?, ?, ?)
+        """, [
+            (item_id, *_price_columns(old)[::2], *_price_columns(new)[::2])
+            for item_id, old, new in changes
+        ])
+        cursor.execute("""
+        SELECT DISTINCT s.user_id, c.item_id
+        FROM temp.sweep_changes c
+        JOIN subscriptions s ON s.item_id = c.item_id
+        LEFT JOIN alert_rules r ON r.subscription_id = s.id
+        LEFT JOIN price_stats ps ON ps.item_id = c.item_id
+        WHERE r.id IS NULL
+           OR r.kind = 'any'
+           OR (r.kind = 'target' AND c.new_cents <= r.threshold
+               AND (c.old_cents IS NULL OR c.new_cents < c.old_cents))
+           OR (r.kind = 'pct_drop' AND c.new_cents <= c.old_cents * (1 - r.threshold / 100.0))
+           OR (r.kind = 'all_time_low' AND c.new_cents <= ps.min_cents AND ps.samples > 1)
+           OR (r.kind = 'back_in_stock' AND c.new_availability = 'available'
+               AND COALESCE(c.old_availability, '') != 'available')
+        """)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
@@ -0,0 +1,187 @@
+# extractors.py
+import html as html_lib
+import os
+import re
+import sys
+import time
+
+import lxml.html
+from bs4 import BeautifulSoup
+
+from config import PARSER_FAST_PATH
+from prices import Price, Availability, parse_amount, currency_from_symbol, unavailable
+
+# Cada extractor recibe el HTML de la página y devuelve (nombre o None, Price).
+# Los extractores rápidos devuelven None cuando no pueden decidir y entonces
+# se recurre a BeautifulSoup.
+
+
+def _build_price(whole, fraction, symbol) -> Price:
+    currency = currency_from_symbol(symbol)
+    if whole is not None and fraction is not None:
+        amount = parse_amount(whole, fraction)
+        if amount is not None:
+            return Price(amount, currency, Availability.AVAILABLE)
+    return unavailable(currency)
+
+
+# ----------------- BEAUTIFULSOUP (REFERENCIA) -----------------
+def extract_soup(html: str) -> tuple:
+    soup = BeautifulSoup(html, "lxml")
+    # El contenido de <template> no se muestra (p. ej. plantillas de otros precios)
+    for template in soup.find_all("template"):
+        template.decompose()
+
+    title_element = soup.find("span", id="productTitle")
+    product_name = title_element.text.strip() if title_element else None
+
+    # Extraer la parte entera, la fraccionaria y el símbolo de la divisa
+    whole_price = soup.select_one("span.a-price-whole")
+    fractional_price = soup.select_one("span.a-price-fraction")
+    symbol = soup.select_one("span.a-price-symbol")
+
+    return product_name, _build_price(
+        whole_price.text if whole_price else None,
+        fractional_price.text if fractional_price else None,
+        symbol.text if symbol else None,
+    )
+
+
+# ----------------- LXML + XPATH -----------------
+def _class_xpath(name):
+    return f"//span[contains(concat(' ', normalize-space(@class), ' '), ' {name} ')][not(ancestor::template)]"
+
+_TITLE_XPATH = "//span[@id='productTitle'][not(ancestor::template)]"
+_WHOLE_XPATH = _class_xpath("a-price-whole")
+_FRACTION_XPATH = _class_xpath("a-price-fraction")
+_SYMBOL_XPATH = _class_xpath("a-price-symbol")
+
+
+def extract_lxml(html: str):
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+    tree = lxml.html.fromstring(html)
+
+    def first_text(xpath):
+        nodes = tree.xpath(xpath)
+        return nodes[0].text_content() if nodes else None
+
+    title = first_text(_TITLE_XPATH)
+    return (title.strip() if title else None), _build_price(
+        first_text(_WHOLE_XPATH), first_text(_FRACTION_XPATH), first_text(_SYMBOL_XPATH)
+    )
+
+
+# ----------------- PRE-ESCANEO CON EXPRESIONES REGULARES -----------------
+def _span_re(attribute):
+    # Primer <span> cuyo atributo coincide; el contenido puede incluir spans anidados
+    # sin texto propio (p. ej. <span class="a-price-decimal">,</span>)
+    return re.compile(
+        r'<span\b[^>]*?\s' + attribute + r'[^>]*>((?:[^<]|<(?!/?span\b)|<span\b[^>]*>[^<]*</span>)*)</span>',
+        re.IGNORECASE | re.DOTALL,
+    )
+
+def _class_attribute(name):
+    return r'class\s*=\s*(["\'])(?:[^"\']*\s)?' + name + r'(?:\s[^"\']*)?\1'
+
+_TITLE_RE = _span_re(r'id\s*=\s*(["\'])productTitle\1')
+_WHOLE_RE = _span_re(_class_attribute("a-price-whole"))
+_FRACTION_RE = _span_re(_class_attribute("a-price-fraction"))
+_SYMBOL_RE = _span_re(_class_attribute("a-price-symbol"))
+_TAG_RE = re.compile(r"<[^>]+>")
+# Zonas que el navegador no muestra y que pueden contener marcado de precios
+# (plantillas en <script type="text/template">, bloques comentados...): se quitan
+# antes de buscar. Sin cierre, llegan hasta el final, como en el navegador
+_HIDDEN_RE = re.compile(
+    r"<!--.*?(?:-->|\Z)|<(script|style|template)\b[^>]*>.*?(?:</\1\s*>|\Z)",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def _span_text(pattern, html):
+    match = pattern.search(html)
+    if not match:
+        return None
+    return html_lib.unescape(_TAG_RE.sub("", match.group(2)))
+
+
+def extract_regex(html: str):
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", errors="replace")
+    html = _HIDDEN_RE.sub("", html)
+
+    title = _span_text(_TITLE_RE, html)
+    whole = _span_text(_WHOLE_RE, html)
+    fraction = _span_text(_FRACTION_RE, html)
+    # Sin título o sin precio la página no es la habitual: que decida BeautifulSoup
+    if title is None or whole is None or fraction is None:
+        return None
+    return title.strip(), _build_price(whole, fraction, _span_text(_SYMBOL_RE, html))
+
+
+EXTRACTORS = {
+    "regex": extract_regex,
+    "lxml": extract_lxml,
+    "soup": extract_soup,
+}
+
+
+def extract_product(html, fast_path: str = PARSER_FAST_PATH) -> tuple:
+    """
+    Extrae el nombre y el precio de una página de producto.
+
+    Prueba primero el extractor rápido configurado y, si no puede decidir,
+    recurre a BeautifulSoup.
+
+    Args:
+        html (str | bytes): Contenido HTML de la página del producto.
+        fast_path (str): Extractor rápido a usar ("regex", "lxml" o "soup").
+
+    Returns:
+        tuple: (nombre del producto o None, Price).
+    """
+    extractor = EXTRACTORS.get(fast_path)
+    if extractor is not None and extractor is not extract_soup:
+        try:
+            result = extractor(html)
+        except (ValueError, lxml.etree.ParserError):
+            result = None
+        if result is not None:
+            return result
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", errors="replace")
+    return extract_soup(html)
+
+
+# ----------------- PARIDAD Y RENDIMIENTO -----------------
+def check_parity(directory: str) -> bool:
+    """
+    Compara cada extractor con BeautifulSoup sobre las páginas guardadas en
+    `directory` e informa del tiempo medio de parseo por página.
+    """
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".html")
+    )
+    pages = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as page:
+            pages[path] = page.read()
+
+    ok = True
+    for name, extractor in EXTRACTORS.items():
+        elapsed = 0.0
+        for path, html in pages.items():
+            expected = extract_soup(html)
+            start = time.perf_counter()
+            result = extract_product(html, fast_path=name)
+            elapsed += time.perf_counter() - start
+            if result != expected:
+                ok = False
+                print(f"[{name}] {os.path.basename(path)}: {result} != {expected}")
+        print(f"{name}: {elapsed / max(1, len(pages)) * 1000:.2f} ms/página")
+    return ok
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join("fixtures", "pages")
+    sys.exit(0 if check_parity(directory) else 1)
@@ -0,0 +1,157 @@
+# fetcher.py
+import asyncio
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import FETCH_WORKERS, FETCH_PER_HOST, FETCH_RATE, SCHEDULER_RESYNC
+from http_client import HTTP_NOT_MODIFIED, get_async_client, timed_get, validators
+from retry import FetchError, RetryBudget, RetryPolicy, send_with_retry
+
+
+class RateLimiter:
+    """
+    Limitador de tipo token bucket para asyncio.
+
+    Reparte `rate` peticiones por segundo entre todas las tareas que lo
+    comparten, permitiendo ráfagas de hasta `burst` peticiones.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class FetchEngine:
+    """
+    Motor de descargas asíncrono.
+
+    Reparte una lista de URLs entre un número fijo de workers, limitando
+    las peticiones simultáneas por dominio y el ritmo global de peticiones.
+    Los límites y el presupuesto de reintentos valen para todas las llamadas
+    a `run` que comparten el motor, aunque se ejecuten a la vez; el
+    presupuesto se renueva cada `budget_window` segundos.
+    """
+
+    def __init__(self, workers: int = FETCH_WORKERS, per_host: int = FETCH_PER_HOST,
+                 rate: float = FETCH_RATE, policy: RetryPolicy = None,
+                 budget_window: float = SCHEDULER_RESYNC):
+        self.workers = max(1, workers)
+        self.per_host = max(1, per_host)
+        self.limiter = RateLimiter(rate, burst=self.per_host)
+        self.policy = policy or RetryPolicy()
+        self.budget_window = budget_window
+        self.budget = RetryBudget()
+        self.budget_expires = time.monotonic() + budget_window
+        self.host_semaphores = {}
+
+    def _current_budget(self) -> RetryBudget:
+        # Presupuesto de reintentos nuevo en cada ventana del planificador
+        now = time.monotonic()
+        if now >= self.budget_expires:
+            self.budget = RetryBudget()
+            self.budget_expires = now + self.budget_window
+        return self.budget
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).hostname or ""
+        if host not in self.host_semaphores:
+            self.host_semaphores[host] = asyncio.Semaphore(self.per_host)
+        return self.host_semaphores[host]
+
+    async def fetch(self, client: httpx.AsyncClient, url: str) -> httpx.Response:
+        """
+        Descarga una URL respetando el límite por dominio y el ritmo global.
+
+        La petición es condicional si se conocen los validadores de la última
+        respuesta, así que una página sin cambios se resuelve con un 304 sin cuerpo.
+        Si el resultado guardado ya no está cuando llega el 304, se vuelve a pedir
+        la página completa.
+        Los errores transitorios se reintentan con backoff; durante la espera el
+        hueco del dominio queda libre para otras URLs.
+
+        Returns:
+            httpx.Response: La respuesta (200 con el HTML sin decodificar, o 304).
+        """
+        async def send(conditional=True):
+            async with self._host_semaphore(url):
+                await self.limiter.acquire()
+                headers = validators.headers(url) if conditional else {}
+                return await timed_get(client, url, headers=headers)
+
+        budget = self._current_budget()
+        response = await send_with_retry(send, url, self.policy, budget)
+        if response.status_code == HTTP_NOT_MODIFIED and validators.value(url) is None:
+            # El resultado guardado se descartó mientras tanto: pedir la página completa
+            response = await send_with_retry(lambda: send(conditional=False), url, self.policy, budget)
+        return response
+
+    async def run(self, jobs, handler):
+        """
+        Procesa todos los trabajos con un pool acotado de workers.
+
+        Args:
+            jobs (iterable): Pares (url, payload) a descargar.
+            handler (callable): Corrutina `handler(payload, response, error)` que se
+                invoca con el resultado de cada descarga. `error` es None si la
+                descarga fue correcta.
+        """
+        queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+
+        async def worker(client):
+            while True:
+                try:
+                    url, payload = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    response, error = await self.fetch(client, url), None
+                except (httpx.HTTPError, FetchError) as e:
+                    response, error = None, e
+                try:
+                    await handler(payload, response, error)
+                except Exception as e:
+                    # Un fallo procesando un producto no debe detener al worker
+                    print(f"Error procesando {url}: {e}")
+
+        # Cliente compartido: las conexiones keep-alive sobreviven entre barridos
+        client = get_async_client()
+        workers = [asyncio.create_task(worker(client))
+                   for _ in range(min(self.workers, queue.qsize()))]
+        await asyncio.gather(*workers)
+
+
+# Un motor por bucle de eventos: sus primitivas de asyncio no se pueden compartir entre bucles
+_engines = weakref.WeakKeyDictionary()
+
+
+def get_fetch_engine() -> FetchEngine:
+    """
+    Motor de descargas compartido por todas las tareas del bucle de eventos actual
+    (lotes del planificador, barridos e importaciones).
+    """
+    loop = asyncio.get_running_loop()
+    engine = _engines.get(loop)
+    if engine is None:
+        engine = _engines[loop] = FetchEngine()
+    return engine
@@ -0,0 +1,154 @@
+# http_client.py
+import asyncio
+import importlib.util
+import threading
+import weakref
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import FETCH_WORKERS, FETCH_TIMEOUT, VALIDATOR_CACHE_SIZE
+from metrics import FETCH_SECONDS
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.141 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+# HTTP/2 solo si está instalado el paquete `h2` (pip install httpx[http2]).
+# La compresión gzip/deflate es automática, y brotli se negocia si está
+# instalado el paquete `brotli` (pip install httpx[brotli]).
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+HTTP_NOT_MODIFIED = 304
+
+# Conexiones keep-alive reutilizadas entre peticiones y entre barridos
+LIMITS = httpx.Limits(
+    max_connections=FETCH_WORKERS * 2,
+    max_keepalive_connections=FETCH_WORKERS,
+    keepalive_expiry=60,
+)
+
+
+class ConditionalCache:
+    """
+    Guarda, por URL, los validadores HTTP (ETag / Last-Modified) de la última
+    respuesta junto con el resultado ya parseado, para pedir la página de
+    forma condicional y reutilizar el resultado cuando el servidor responde 304.
+    """
+
+    def __init__(self, max_entries: int = VALIDATOR_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def headers(self, url: str) -> dict:
+        """
+        Cabeceras condicionales para la próxima petición a `url`.
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+        if entry is None:
+            return {}
+        etag, last_modified, _ = entry
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def remember(self, url: str, response: httpx.Response, value):
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        with self.lock:
+            if not etag and not last_modified:
+                self.entries.pop(url, None)
+                return
+            self.entries[url] = (etag, last_modified, value)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def value(self, url: str):
+        """
+        Resultado parseado de la última respuesta completa de `url`, o None.
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            self.entries.move_to_end(url)
+            return entry[2]
+
+
+# Validadores compartidos por el barrido y por los comandos del bot
+validators = ConditionalCache()
+
+_client = None
+_client_lock = threading.Lock()
+# Un cliente asíncrono por bucle de eventos (no se pueden compartir entre bucles)
+_async_clients = weakref.WeakKeyDictionary()
+# Transporte alternativo de los clientes asíncronos (None = la red real)
+_async_transport = None
+
+
+def _client_options() -> dict:
+    return {
+        "headers": HEADERS,
+        "timeout": FETCH_TIMEOUT,
+        "follow_redirects": True,
+        "http2": HTTP2_AVAILABLE,
+        "limits": LIMITS,
+    }
+
+
+def get_client() -> httpx.Client:
+    """
+    Cliente HTTP síncrono compartido por todo el proceso.
+    """
+    global _client
+    with _client_lock:
+        if _client is None or _client.is_closed:
+            _client = httpx.Client(**_client_options())
+        return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Cliente HTTP asíncrono compartido por todas las tareas del bucle de eventos actual.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        options = _client_options()
+        if _async_transport is not None:
+            options["transport"] = _async_transport
+        client = httpx.AsyncClient(**options)
+        _async_clients[loop] = client
+    return client
+
+
+async def timed_get(client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response:
+    """
+    `client.get` midiendo la duración de la petición en la métrica de su dominio.
+    """
+    with FETCH_SECONDS.time(host=urlsplit(url).hostname or ""):
+        return await client.get(url, **kwargs)
+
+
+def timed_get_sync(client: httpx.Client, url: str, **kwargs) -> httpx.Response:
+    with FETCH_SECONDS.time(host=urlsplit(url).hostname or ""):
+        return client.get(url, **kwargs)
+
+
+def set_async_transport(transport: httpx.AsyncBaseTransport = None):
+    """
+    Envía las peticiones de los clientes asíncronos que se creen a partir de ahora
+    por `transport` (None vuelve a la red real). Lo usa `benchmark.py` para dirigir
+    las descargas al servidor de réplica local en lugar de a Amazon.
+    """
+    global _async_transport
+    _async_transport = transport
+    _async_clients.clear()
@@ -3,12 +3,11 @@
 import sys
 import multiprocessing
 
-from gui import PriceTrackerGUI  
-from bot import run_bot
-
-import tkinter as tk
-
+# Cada modo importa solo lo que necesita: el worker no usa Telegram ni necesita TOKEN
 def run_gui():
+    import tkinter as tk
+    from gui import PriceTrackerGUI
+
     root = tk.Tk()
     app = PriceTrackerGUI(root)
     root.mainloop()
@@ -22,7 +21,26 @@ if __name__ == "__main__":
 
     # Si se pasó --run-bot, ejecutamos el bot
     if "--run-bot" in sys.argv:
+        from bot import run_bot
         run_bot()
+    # --run-worker: revisar precios desde la cola compartida (con SCHEDULER_MODE=workers en el bot)
+    elif "--run-worker" in sys.argv:
+        from worker import run_worker
+        run_worker()
+    # --import <archivo> <user_id>: añadir de una vez las URLs de un archivo
+    elif "--import" in sys.argv:
+        from bulk import run_cli_import
+        index = sys.argv.index("--import")
+        if len(sys.argv) < index + 3:
+            sys.exit("Uso: main.py --import <archivo> <user_id>")
+        run_cli_import(sys.argv[index + 1], int(sys.argv[index + 2]))
+    # --export <user_id> [csv|jsonl]: volcar los productos y el historial por la salida estándar
+    elif "--export" in sys.argv:
+        from bulk import run_cli_export
+        index = sys.argv.index("--export")
+        if len(sys.argv) < index + 2:
+            sys.exit("Uso: main.py --export <user_id> [csv|jsonl]")
+        run_cli_export(int(sys.argv[index + 1]), sys.argv[index + 2] if len(sys.argv) > index + 2 else "csv")
     else:
         # De lo contrario, lanzamos la GUI
         run_gui()
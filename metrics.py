@@ -0,0 +1,229 @@
+# metrics.py
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Límites (en segundos) de los histogramas, como los de los clientes de Prometheus
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SWEEP_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+LAG_BUCKETS = (0.1, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra="") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """
+    Base de las métricas: un valor por combinación de etiquetas, protegido por un
+    cerrojo porque se actualizan desde el bucle de eventos y desde los hilos de la BD.
+    """
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """
+        Líneas de exposición (sin HELP ni TYPE) de la métrica.
+        """
+        with self.lock:
+            values = list(self.values.items())
+        for key, value in sorted(values):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Valor que sube y baja. Con `set_function`, el valor se calcula al exponerlo.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.function = None
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            yield f"{self.name} {_format_value(self.function())}"
+            return
+        yield from super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # Cuenta por tramo (el último es +Inf), suma y número de observaciones
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Mide la duración del bloque `with`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = [(key, (list(counts), total, count)) for key, (counts, total, count) in self.values.items()]
+        for key, (counts, total, count) in sorted(values):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+
+    def add_collector(self, collector):
+        """
+        `collector()` se llama una vez al principio de cada exposición para
+        actualizar métricas que se leen de otra parte (p. ej. de la base de datos).
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Todas las métricas en el formato de texto de Prometheus.
+        """
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Error al actualizar las métricas: {e}")
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ----------------- MÉTRICAS DEL BOT -----------------
+# Descargas (cada intento cuenta por separado)
+FETCH_SECONDS = Histogram("tracker_fetch_seconds", "Duración de cada petición HTTP por dominio.", ["host"])
+HTTP_RESPONSES = Counter("tracker_http_responses_total",
+                         "Respuestas HTTP por dominio y código (error = sin respuesta).", ["host", "status"])
+FETCH_RETRIES = Counter("tracker_fetch_retries_total",
+                        "Reintentos por dominio y motivo (retry = transitorio, throttled = 429/503/captcha).",
+                        ["host", "outcome"])
+CIRCUIT_OPEN = Counter("tracker_circuit_open_total", "Peticiones rechazadas por tener el dominio en pausa.", ["host"])
+
+# Parseo y barridos
+PARSE_SECONDS = Histogram("tracker_parse_seconds", "Tiempo de parseo de una página de producto.")
+ITEMS_CHECKED = Counter("tracker_items_checked_total", "Productos revisados por resultado.", ["result"])
+SWEEP_SECONDS = Histogram("tracker_sweep_seconds", "Duración de los barridos completos.", buckets=SWEEP_BUCKETS)
+LAST_SWEEP_START = Gauge("tracker_last_sweep_start_timestamp_seconds", "Inicio del último barrido completo terminado.")
+LAST_SWEEP_END = Gauge("tracker_last_sweep_end_timestamp_seconds", "Fin del último barrido completo terminado.")
+LAST_SWEEP_DURATION = Gauge("tracker_last_sweep_duration_seconds", "Duración del último barrido completo terminado.")
+LAST_SWEEP_ITEMS = Gauge("tracker_last_sweep_items", "Productos revisados en el último barrido completo terminado.")
+SCHEDULE_LAG = Histogram("tracker_schedule_lag_seconds",
+                         "Retraso de cada revisión (o barrido) respecto a la hora a la que estaba programada.",
+                         buckets=LAG_BUCKETS)
+
+# Base de datos
+DB_SECONDS = Histogram("tracker_db_seconds", "Duración de las consultas de `database` por función.", ["function"])
+
+# Notificaciones
+NOTIFY_QUEUE = Gauge("tracker_notify_queue_depth", "Cambios de precio pendientes de notificar.")
+TELEGRAM_SEND_SECONDS = Histogram("tracker_telegram_send_seconds", "Duración de cada envío a Telegram.")
+NOTIFICATIONS = Counter("tracker_notifications_total", "Envíos a Telegram por resultado.", ["result"])
+
+
+# ----------------- SERVIDOR HTTP -----------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Expone las métricas en http://host:port/metrics desde un hilo en segundo plano.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
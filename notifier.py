@@ -0,0 +1,198 @@
+# notifier.py
+import asyncio
+import time
+
+from telegram.error import Forbidden, BadRequest, NetworkError, RetryAfter, TelegramError
+
+from config import NOTIFY_RATE, NOTIFY_CHAT_INTERVAL, NOTIFY_WORKERS
+from fetcher import RateLimiter
+from metrics import NOTIFICATIONS, TELEGRAM_SEND_SECONDS
+from prices import format_price
+
+# Longitud máxima de un mensaje de Telegram
+MAX_MESSAGE_LENGTH = 4096
+# Intentos por mensaje ante errores de red
+MAX_SEND_ATTEMPTS = 3
+
+
+def price_highlight(price, stats):
+    """
+    Texto que destaca un precio que es mínimo histórico o de los últimos 90/30 días, o None.
+
+    `stats` ya incluye el precio nuevo, así que un mínimo se reconoce porque coincide con él.
+    """
+    if stats is None or price is None or price.amount is None or stats.samples < 2:
+        return None
+    if price.amount <= stats.min_cents:
+        return "📉 ¡Precio más bajo registrado!"
+    if stats.min_90d_cents is not None and price.amount <= stats.min_90d_cents:
+        return "📉 Precio más bajo de los últimos 90 días"
+    if stats.min_30d_cents is not None and price.amount <= stats.min_30d_cents:
+        return "📉 Precio más bajo de los últimos 30 días"
+    return None
+
+
+def format_change(product_name, url, last_price, current_price, stats=None) -> str:
+    text = (
+        f"[{product_name}]({url})\n"
+        f"**Nuevo precio:** {format_price(current_price)}\n"
+        f"**Precio anterior:** {format_price(last_price)}"
+    )
+    highlight = price_highlight(current_price, stats)
+    return f"{text}\n{highlight}" if highlight else text
+
+
+def build_messages(changes: list) -> list:
+    """
+    Agrupa los cambios de precio de un usuario en uno o varios mensajes
+    (los resúmenes largos se parten para no superar el límite de Telegram).
+
+    Args:
+        changes (list): Tuplas (nombre, URL, precio anterior, precio nuevo, PriceStats o None).
+    """
+    if len(changes) == 1:
+        return ["El precio del producto ha cambiado:\n" + format_change(*changes[0])]
+
+    messages = []
+    text = f"Ha cambiado el precio de {len(changes)} productos:"
+    for change in changes:
+        block = "\n\n" + format_change(*change)
+        if len(text) + len(block) > MAX_MESSAGE_LENGTH:
+            messages.append(text)
+            text = block.lstrip()
+        else:
+            text += block
+    messages.append(text)
+    return messages
+
+
+def _seconds(retry_after) -> float:
+    # Según la versión de python-telegram-bot, RetryAfter.retry_after es un entero o un timedelta
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+class NotificationDispatcher:
+    """
+    Cola de notificaciones de Telegram desacoplada del barrido.
+
+    `notify()` solo encola el cambio y vuelve al momento. Unos pocos workers
+    envían los mensajes respetando un límite global de `rate` mensajes por
+    segundo y un mensaje cada `chat_interval` segundos por chat, y esperan lo
+    que indique Telegram cuando responde RetryAfter. Los cambios que se
+    acumulan para un mismo usuario mientras espera su turno se envían juntos
+    en un único resumen.
+    """
+
+    def __init__(self, bot, rate: float = NOTIFY_RATE, chat_interval: float = NOTIFY_CHAT_INTERVAL,
+                 workers: int = NOTIFY_WORKERS):
+        self.bot = bot
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self.workers = max(1, workers)
+        self.pending = {}     # chat_id -> cambios pendientes de enviar
+        self.next_send = {}   # chat_id -> hora a partir de la que se puede volver a escribir
+        self.sending = set()  # chats que está atendiendo algún worker
+        self.paused_until = 0.0
+        self.loop = None
+        self.queue = None
+        self.tasks = []
+        self.sent = 0
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        # Primera notificación en este bucle de eventos: crear la cola y los workers
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.limiter = RateLimiter(self.rate, burst=int(self.rate) or 1)
+        self.sending = set()
+        self.tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        for chat_id in self.pending:
+            self.queue.put_nowait(chat_id)
+
+    @property
+    def depth(self) -> int:
+        """
+        Cambios encolados que aún no se han enviado.
+        """
+        return sum(map(len, list(self.pending.values())))
+
+    def notify(self, chat_id, product_name, url, last_price, current_price, stats=None):
+        """
+        Encola un cambio de precio para un usuario. No espera al envío.
+        """
+        self._ensure_started()
+        changes = self.pending.setdefault(chat_id, [])
+        changes.append((product_name, url, last_price, current_price, stats))
+        if len(changes) == 1:
+            self.queue.put_nowait(chat_id)
+
+    async def join(self):
+        """
+        Espera a que se hayan enviado todas las notificaciones encoladas.
+        """
+        if self.queue is not None:
+            await self.queue.join()
+
+    async def _wait_chat(self, chat_id):
+        while True:
+            wait = max(self.paused_until, self.next_send.get(chat_id, 0.0)) - time.monotonic()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def _wait_turn(self, chat_id):
+        await self._wait_chat(chat_id)
+        await self.limiter.acquire()
+        self.next_send[chat_id] = time.monotonic() + self.chat_interval
+
+    async def _send(self, chat_id, text):
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            await self._wait_turn(chat_id)
+            try:
+                with TELEGRAM_SEND_SECONDS.time():
+                    await self.bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown")
+                self.sent += 1
+                NOTIFICATIONS.inc(result="sent")
+                return
+            except RetryAfter as e:
+                # Límite de Telegram: se pausan todos los envíos lo que indique
+                NOTIFICATIONS.inc(result="retry_after")
+                self.paused_until = max(self.paused_until, time.monotonic() + _seconds(e.retry_after))
+            except (Forbidden, BadRequest) as e:
+                # Usuario que ha bloqueado el bot, chat inexistente...: no tiene sentido reintentar
+                NOTIFICATIONS.inc(result="rejected")
+                print(f"No se pudo notificar a {chat_id}: {e}")
+                return
+            except NetworkError as e:
+                NOTIFICATIONS.inc(result="network_error")
+                print(f"Error de red al notificar a {chat_id} ({attempt + 1}/{MAX_SEND_ATTEMPTS}): {e}")
+        NOTIFICATIONS.inc(result="dropped")
+        print(f"Se descarta la notificación para {chat_id} tras {MAX_SEND_ATTEMPTS} intentos.")
+
+    async def _worker(self):
+        while True:
+            chat_id = await self.queue.get()
+            if chat_id in self.sending:
+                # Otro worker está escribiendo a este chat (quizá esperando al límite global):
+                # lo volverá a encolar al terminar, respetando el intervalo del chat
+                self.queue.task_done()
+                continue
+            self.sending.add(chat_id)
+            try:
+                # Esperar el turno del chat antes de recoger sus cambios, para que
+                # lo que llegue mientras tanto vaya en el mismo resumen
+                await self._wait_chat(chat_id)
+                changes = self.pending.pop(chat_id, [])
+                for text in build_messages(changes) if changes else []:
+                    await self._send(chat_id, text)
+            except TelegramError as e:
+                print(f"Error al notificar a {chat_id}: {e}")
+            except Exception as e:
+                print(f"Error inesperado al notificar a {chat_id}: {e}")
+            finally:
+                self.sending.discard(chat_id)
+                if self.pending.get(chat_id):
+                    self.queue.put_nowait(chat_id)
+                self.queue.task_done()
@@ -0,0 +1,83 @@
+# parse_pool.py
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import PARSE_WORKERS
+from metrics import PARSE_SECONDS
+from price_tracker import parse_product_info
+from prices import price_from_row
+
+
+def parse_page(content: bytes) -> tuple:
+    """
+    Parsea una página en un proceso del pool.
+
+    Recibe los bytes tal cual llegan de la red y devuelve una tupla compacta
+    (nombre, céntimos, divisa, disponibilidad) que es barata de enviar de vuelta.
+    """
+    product_name, price = parse_product_info(content)
+    return product_name, price.amount, price.currency, price.availability.value
+
+
+class ParsePool:
+    """
+    Etapa de parseo del barrido: reparte el trabajo de CPU entre varios
+    procesos para no quedar limitados por el GIL del proceso del bot.
+    """
+
+    def __init__(self, workers: int = PARSE_WORKERS):
+        self.workers = workers
+        self.executor = None
+        # Lo usan el bucle del bot y el del planificador, cada uno en su hilo
+        self.lock = threading.Lock()
+
+    def _get_executor(self):
+        # El pool se crea la primera vez que se usa y se reutiliza entre barridos.
+        # Con "spawn" (como en el ejecutable congelado): un fork copiaría un proceso
+        # con hilos y cerrojos tomados, y el hijo podría quedarse bloqueado
+        with self.lock:
+            if self.executor is None and self.workers > 0:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self.executor
+
+    def _discard(self, executor):
+        # Un proceso del pool murió (p. ej. por falta de memoria): el pool ya no sirve
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def parse(self, content: bytes) -> tuple:
+        """
+        Returns:
+            tuple: (nombre del producto, Price).
+        """
+        executor = self._get_executor()
+        with PARSE_SECONDS.time():
+            if executor is None:
+                result = await asyncio.to_thread(parse_page, content)
+            else:
+                loop = asyncio.get_running_loop()
+                try:
+                    result = await loop.run_in_executor(executor, parse_page, content)
+                except BrokenProcessPool:
+                    # Se crea un pool nuevo y se reintenta una vez
+                    self._discard(executor)
+                    result = await loop.run_in_executor(self._get_executor(), parse_page, content)
+        product_name, *price = result
+        return product_name, price_from_row(*price)
+
+    def close(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+# Pool compartido por todos los barridos del proceso
+parse_pool = ParsePool()
@@ -1,10 +1,13 @@
 import asyncio
-from price_tracker import get_product_info
 from telegram import Bot
 from dotenv import load_dotenv
 import os
-from database import record_price_change, get_product_id, get_last_price, get_all_products, update_product_price
-from asyncio import Semaphore
+import checker
+from async_database import get_all_products, get_price_stats, get_queued_notifications, delete_notifications
+from checker import plan_sweep
+from metrics import NOTIFY_QUEUE
+from notifier import NotificationDispatcher
+from scheduler import SweepCoordinator
 
 # Cargar variables de entorno
 load_dotenv()
@@ -17,31 +20,48 @@ if not TOKEN:
 
 # Crear instancia del bot
 bot = Bot(token=TOKEN)
-
-semaphore = Semaphore(5)  # Límite de 5 tareas concurrentes
+# Cola de notificaciones con los límites de envío de Telegram
+notifier = NotificationDispatcher(bot)
+NOTIFY_QUEUE.set_function(lambda: notifier.depth)
 
 async def check_prices():
-    async with semaphore:
-        # Obtener todos los productos desde la base de datos
-        products = get_all_products()
-
-        for product in products:
-            product_id, user_id, url, name = product
-
-            product_name, current_price = get_product_info(url)
-            last_price = get_last_price(product_id)
-
-            if current_price != last_price:
-                record_price_change(product_id, current_price)
-                update_product_price(product_id, current_price)
-
-                await bot.send_message(
-                    chat_id=user_id,
-                    text=(
-                        f"El precio del producto ha cambiado:\n"
-                        f"[{product_name}]({url})\n"
-                        f"**Nuevo precio:** {current_price}\n"
-                        f"**Precio anterior:** {last_price}"
-                    ),
-                    parse_mode="Markdown"
-                )
+    # Obtener todos los productos desde la base de datos y descargar cada uno una sola vez
+    return await check_items(plan_sweep(await get_all_products()))
+
+async def check_items(plan):
+    """
+    Revisa los productos de `plan` (como `checker.check_items`) y encola los avisos en el notificador.
+    """
+    return await checker.check_items(plan, notify_all)
+
+async def notify_all(notifications):
+    """
+    Encola los avisos (user_id, item_id, nombre, URL, Price anterior, Price nuevo) en el notificador.
+    Solo se encolan: el envío lo hace el notificador sin retrasar el barrido.
+    """
+    # Estadísticas ya actualizadas con los nuevos precios, para destacar mínimos en los avisos
+    stats = await get_price_stats({item_id for _, item_id, *_ in notifications})
+    for user_id, item_id, product_name, url, last_price, current_price in notifications:
+        notifier.notify(user_id, product_name, url, last_price, current_price, stats.get(item_id))
+
+async def dispatch_outbox(poll: float, batch_size: int = 500):
+    """
+    Bucle del bot cuando la revisión la hacen los workers: envía los avisos que los
+    workers dejan en la base de datos y los borra una vez enviados.
+    """
+    while True:
+        try:
+            queued = await get_queued_notifications(batch_size)
+            if queued:
+                await notify_all([row[1:] for row in queued])
+                # Se borran tras el envío: si el bot se cae antes, se reenvían al arrancar
+                await notifier.join()
+                await delete_notifications([row[0] for row in queued])
+                continue
+        except Exception as e:
+            print(f"Error al enviar los avisos de los workers: {e}")
+        await asyncio.sleep(poll)
+
+
+# Coordinador de los barridos completos del modo fijo
+sweeps = SweepCoordinator(check_items)
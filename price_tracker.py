@@ -1,29 +1,25 @@
-import requests
-from bs4 import BeautifulSoup
-import time
-import random
-
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.141 Safari/537.36",
-    "Accept-Language": "en-US,en;q=0.9",
-}
-
-def retry_request(func):
-    def wrapper(*args, **kwargs):
-        max_retries = 40
-        for attempt in range(1, max_retries + 1):
-            try:
-                return func(*args, **kwargs)
-            except requests.exceptions.RequestException as e:
-                if attempt == max_retries:
-                    raise e
-                wait_time = random.uniform(1, 5)
-                print(f"Reintentando ({attempt}/10)... Esperando {wait_time:.2f} segundos.")
-                time.sleep(wait_time)
-    return wrapper
-
-@retry_request
-def get_price(url: str) -> str:
+import asyncio
+from prices import Price
+from extractors import extract_product
+from config import INTERACTIVE_MAX_ATTEMPTS
+from http_client import HTTP_NOT_MODIFIED, get_client, get_async_client, timed_get, timed_get_sync, validators
+from metrics import PARSE_SECONDS
+from product_cache import product_cache
+from retry import RetryPolicy, send_with_retry, send_with_retry_sync
+
+# Los comandos del bot no pueden esperar mucho: pocos intentos y esperas cortas
+INTERACTIVE_POLICY = RetryPolicy(max_attempts=INTERACTIVE_MAX_ATTEMPTS, max_delay=5.0)
+
+def _result_from_response(url: str, response) -> tuple:
+    # 304: la página no ha cambiado y se reutiliza el último resultado
+    if response.status_code == HTTP_NOT_MODIFIED:
+        return validators.value(url)
+    with PARSE_SECONDS.time():
+        result = parse_product_info(response.content)
+    validators.remember(url, response, result)
+    return result
+
+def get_price(url: str) -> Price:
     """
     Extrae el precio de un producto en Amazon a partir de su URL.
 
@@ -31,60 +27,96 @@ def get_price(url: str) -> str:
         url (str): URL de la página del producto.
 
     Returns:
-        str: El precio del producto como texto. Si no se encuentra, devuelve un mensaje de error.
+        Price: El precio del producto. Si no se encuentra, su disponibilidad es UNAVAILABLE.
     """
-    response = requests.get(url, headers=HEADERS)
-    response.raise_for_status()
+    _, price = get_product_info(url)
+    return price
 
-    # Parsear el HTML con BeautifulSoup
-    soup = BeautifulSoup(response.text, "lxml")
+def get_product_info(url: str) -> tuple:
+    """
+    Extrae el nombre y el precio de un producto de Amazon (versión síncrona
+    para scripts y la GUI; desde el bot se usa `fetch_product_info`).
 
-    # Extraer la parte entera y fraccionaria del precio
-    whole_price = soup.select_one("span.a-price-whole")
-    fractional_price = soup.select_one("span.a-price-fraction")
-    print(whole_price, fractional_price)
+    Args:
+        url (str): URL de la página del producto.
 
-    if whole_price and fractional_price:
-        # Limpiar los datos y combinar las partes del precio
-        price_whole = whole_price.text.strip().replace(",", "")
-        price_fraction = fractional_price.text.strip()
-        price = f"{price_whole},{price_fraction} €"
-        return price
+    Returns:
+        tuple: (nombre del producto, Price). Si no se encuentra el nombre, devuelve un mensaje de error.
+    """
+    # Cliente compartido (keep-alive) y petición condicional
+    client = get_client()
+    response = send_with_retry_sync(
+        lambda: timed_get_sync(client, url, headers=validators.headers(url)), url, RetryPolicy()
+    )
+    result = _result_from_response(url, response)
+    if result is None:
+        # El resultado guardado se descartó mientras tanto: pedir la página completa
+        response = send_with_retry_sync(lambda: timed_get_sync(client, url), url, RetryPolicy())
+        result = _result_from_response(url, response)
+    return result
+
+async def fetch_product_info(url: str) -> tuple:
+    """
+    Versión asíncrona de `get_product_info` para los comandos del bot: las
+    esperas entre reintentos no bloquean el bucle de eventos.
 
-    return "No se pudo encontrar el precio en esta página."
+    Raises:
+        retry.FetchError, httpx.HTTPError: Si no se pudo descargar la página.
+    """
+    client = get_async_client()
+    response = await send_with_retry(
+        lambda: timed_get(client, url, headers=validators.headers(url)), url, INTERACTIVE_POLICY
+    )
+    result = await asyncio.to_thread(_result_from_response, url, response)
+    if result is None:
+        response = await send_with_retry(lambda: timed_get(client, url), url, INTERACTIVE_POLICY)
+        result = await asyncio.to_thread(_result_from_response, url, response)
+    return result
+
+async def lookup_product_info(url: str) -> tuple:
+    """
+    Como `fetch_product_info`, pero reutiliza el resultado de la caché de productos
+    si el producto se descargó hace poco (en el barrido o en otra consulta), y las
+    consultas simultáneas de la misma URL comparten una única descarga.
 
-@retry_request
-def get_product_info(url: str) -> tuple:
+    Raises:
+        retry.FetchError, httpx.HTTPError: Si no se pudo descargar la página.
     """
-    Extrae el nombre y el precio de un producto de Amazon.
+    return await product_cache.get_or_fetch(url, fetch_product_info)
+
+async def fetch_price(url: str) -> Price:
+    _, price = await lookup_product_info(url)
+    return price
+
+
+def parse_price(html: str) -> Price:
+    """
+    Extrae el precio de un producto a partir del HTML ya descargado.
 
     Args:
-        url (str): URL de la página del producto.
+        html (str): Contenido HTML de la página del producto.
 
     Returns:
-        tuple: (nombre del producto, precio del producto). Si no se encuentra, devuelve mensajes de error.
+        Price: El precio del producto. Si no se encuentra, su disponibilidad es UNAVAILABLE.
     """
-    response = requests.get(url, headers=HEADERS)
-    response.raise_for_status()
-    soup = BeautifulSoup(response.text, "lxml")
+    _, price = extract_product(html)
+    return price
 
-    # Extraer nombre del producto
-    title_element = soup.find("span", id="productTitle")
-    product_name = title_element.text.strip() if title_element else None
 
-    # Extraer el precio del producto
-    whole_price = soup.select_one("span.a-price-whole")
-    fractional_price = soup.select_one("span.a-price-fraction")
+def parse_product_info(html: str) -> tuple:
+    """
+    Extrae el nombre y el precio de un producto a partir del HTML ya descargado.
+
+    Args:
+        html (str | bytes): Contenido HTML de la página del producto.
 
-    if whole_price and fractional_price:
-        price = f"{whole_price.text.strip().replace(',', '')},{fractional_price.text.strip()} €"
-    else:
-        price = None
+    Returns:
+        tuple: (nombre del producto, Price). Si no se encuentra el nombre, devuelve un mensaje de error.
+    """
+    product_name, price = extract_product(html)
 
-    # Validar que se obtuvo el nombre y el precio
+    # Validar que se obtuvo el nombre
     if not product_name:
         product_name = "Nombre no disponible"
-    if not price:
-        price = "Precio no disponible"
 
     return product_name, price
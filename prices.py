@@ -0,0 +1,127 @@
+# prices.py
+import re
+from collections import namedtuple
+from enum import Enum
+
+
+class Availability(str, Enum):
+    AVAILABLE = "available"
+    UNAVAILABLE = "unavailable"
+
+
+# Precio en unidades menores (céntimos) + divisa ISO 4217 + disponibilidad.
+# `amount` es None cuando el producto no tiene precio disponible.
+Price = namedtuple("Price", ["amount", "currency", "availability"])
+
+# Estadísticas precalculadas de un producto (tabla `price_stats`). Importes en céntimos;
+# `min_at`/`max_at` son la última vez que se alcanzó el mínimo/máximo histórico.
+PriceStats = namedtuple("PriceStats", [
+    "currency", "min_cents", "min_at", "max_cents", "max_at",
+    "min_30d_cents", "min_90d_cents", "average_cents", "samples", "last_change_at",
+])
+
+DEFAULT_CURRENCY = "EUR"
+
+# Símbolos que muestra Amazon junto al precio
+CURRENCY_SYMBOLS = {
+    "€": "EUR",
+    "£": "GBP",
+    "$": "USD",
+    "US$": "USD",
+    "¥": "JPY",
+    "￥": "JPY",
+    "zł": "PLN",
+    "kr": "SEK",
+    "R$": "BRL",
+}
+
+# Símbolo con el que se muestra cada divisa
+CURRENCY_DISPLAY = {
+    "EUR": "€",
+    "GBP": "£",
+    "USD": "$",
+    "JPY": "¥",
+    "PLN": "zł",
+    "SEK": "kr",
+    "BRL": "R$",
+}
+
+NOT_AVAILABLE_TEXT = "Precio no disponible"
+
+
+def unavailable(currency: str = DEFAULT_CURRENCY) -> Price:
+    return Price(None, currency, Availability.UNAVAILABLE)
+
+
+def currency_from_symbol(symbol) -> str:
+    if not symbol:
+        return DEFAULT_CURRENCY
+    return CURRENCY_SYMBOLS.get(symbol.strip(), DEFAULT_CURRENCY)
+
+
+def parse_amount(whole: str, fraction: str = "") -> int:
+    """
+    Convierte las partes entera y decimal que muestra Amazon en céntimos.
+
+    Args:
+        whole (str): Parte entera, con separadores de miles o decimal (p. ej. "1.234,").
+        fraction (str): Parte decimal (p. ej. "99").
+
+    Returns:
+        int: Importe en unidades menores, o None si no hay dígitos.
+    """
+    whole_digits = re.sub(r"\D", "", whole or "")
+    fraction_digits = re.sub(r"\D", "", fraction or "")
+    if not whole_digits:
+        return None
+    return int(whole_digits) * 100 + int(fraction_digits.ljust(2, "0")[:2])
+
+
+def parse_user_amount(text: str) -> int:
+    """
+    Convierte un importe escrito por el usuario ("49,99", "49.99", "1.299,00 €") a céntimos.
+
+    Returns:
+        int: Importe en céntimos, o None si el texto no es un importe.
+    """
+    match = re.fullmatch(r"\s*(\d[\d.\s]*?)(?:[.,](\d{1,2}))?\s*[^\d\s]*\s*", text or "")
+    if not match:
+        return None
+    return parse_amount(match.group(1), match.group(2) or "")
+
+
+def parse_price_text(text) -> Price:
+    """
+    Convierte un precio en texto ("1234,99 €", "Precio no disponible", ...) a `Price`.
+
+    Se usa para migrar los precios guardados como texto en versiones anteriores.
+    """
+    if not text:
+        return unavailable()
+
+    match = re.search(r"(\d[\d.\s]*)(?:,(\d{1,2}))?\s*(\S*)", text)
+    if not match:
+        return unavailable()
+
+    amount = parse_amount(match.group(1), match.group(2) or "")
+    return Price(amount, currency_from_symbol(match.group(3)), Availability.AVAILABLE)
+
+
+def format_price(price) -> str:
+    """
+    Formatea un `Price` para mostrarlo al usuario, p. ej. "1234,99 €".
+    """
+    if price is None or price.amount is None:
+        return NOT_AVAILABLE_TEXT
+    units, cents = divmod(price.amount, 100)
+    symbol = CURRENCY_DISPLAY.get(price.currency, price.currency)
+    return f"{units},{cents:02d} {symbol}"
+
+
+def price_from_row(amount, currency, availability) -> Price:
+    """
+    Construye un `Price` a partir de las columnas de la base de datos.
+    """
+    if availability is None:
+        return None
+    return Price(amount, currency, Availability(availability))
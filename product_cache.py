@@ -0,0 +1,122 @@
+# product_cache.py
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from async_database import save_cached_products, get_cached_product
+from config import PRODUCT_CACHE_TTL, PRODUCT_CACHE_SIZE, PRODUCT_CACHE_PERSIST
+from utils import canonicalize_url
+
+
+class ProductCache:
+    """
+    Últimos resultados parseados (nombre, Price) por URL canónica, con caducidad
+    y expulsión LRU. El barrido guarda aquí cada producto que descarga y los
+    comandos del bot consultan primero la caché, de modo que un /checkprice de
+    un producto descargado hace poco responde sin salir a Amazon.
+
+    Las consultas simultáneas de una misma URL comparten una única descarga.
+    Con `persist`, los resultados también se guardan en SQLite y sobreviven a
+    un reinicio del bot.
+    """
+
+    def __init__(self, ttl: float = PRODUCT_CACHE_TTL, max_entries: int = PRODUCT_CACHE_SIZE,
+                 persist: bool = bool(PRODUCT_CACHE_PERSIST)):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persist = persist
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Resultados pendientes de guardar en SQLite
+        self.dirty = []
+        # Descargas en curso por URL canónica
+        self.inflight = {}
+
+    def get(self, url: str):
+        """
+        Resultado reciente de `url` guardado en memoria, o None si no hay o ha caducado.
+        """
+        url = canonicalize_url(url)
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            result, fetched_at = entry
+            if time.time() - fetched_at > self.ttl:
+                del self.entries[url]
+                return None
+            self.entries.move_to_end(url)
+            return result
+
+    def put(self, url: str, result: tuple, fetched_at: float = None):
+        """
+        Guarda el resultado (nombre, Price) recién obtenido para `url`.
+        """
+        if self.ttl <= 0 or result is None:
+            return
+        url = canonicalize_url(url)
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        with self.lock:
+            self.entries[url] = (result, fetched_at)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            if self.persist:
+                self.dirty.append((url, *result, fetched_at))
+
+    async def flush(self):
+        """
+        Guarda en SQLite, en una sola transacción, los resultados pendientes.
+        """
+        with self.lock:
+            rows, self.dirty = self.dirty, []
+        if rows:
+            await save_cached_products(rows, time.time() - self.ttl)
+
+    async def lookup(self, url: str):
+        """
+        Como `get`, pero si no está en memoria lo busca en SQLite (con `persist`).
+        """
+        result = self.get(url)
+        if result is not None or not self.persist or self.ttl <= 0:
+            return result
+        url = canonicalize_url(url)
+        row = await get_cached_product(url, time.time() - self.ttl)
+        if row is None:
+            return None
+        name, price, fetched_at = row
+        with self.lock:
+            self.entries[url] = ((name, price), fetched_at)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return name, price
+
+    async def _fetch(self, url: str, fetch):
+        result = await fetch(url)
+        self.put(url, result)
+        await self.flush()
+        return result
+
+    async def get_or_fetch(self, url: str, fetch) -> tuple:
+        """
+        Devuelve el resultado reciente de `url` o lo descarga con `fetch(url)`.
+
+        Si otra tarea ya está descargando la misma URL, espera a esa descarga.
+        Los errores de `fetch` se propagan y no se guardan.
+        """
+        url = canonicalize_url(url)
+        result = await self.lookup(url)
+        if result is not None:
+            return result
+        task = self.inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(url, fetch))
+            self.inflight[url] = task
+            task.add_done_callback(lambda _: self.inflight.pop(url, None))
+        # shield: si quien espera se cancela, la descarga sigue para los demás
+        return await asyncio.shield(task)
+
+
+# Caché compartida por el barrido y los comandos del bot
+product_cache = ProductCache()
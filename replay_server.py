@@ -0,0 +1,185 @@
+# replay_server.py
+import argparse
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from utils import extract_asin
+
+DEFAULT_PAGES = os.path.join("fixtures", "pages")
+CAPTCHA_PAGE = "captcha.html"
+
+# Parte entera del precio en las páginas guardadas ("89", "2.349", "1,299"...)
+PRICE_WHOLE_PATTERN = re.compile(r'(class=["\']a-price-whole[^>]*>)[\d.,]+')
+
+
+class ReplayServer:
+    """
+    Servidor HTTP local que hace de Amazon con páginas de producto guardadas,
+    para medir el rastreo sin salir a la red.
+
+    Cada ASIN recibe siempre la misma página de `pages_dir` con un precio propio,
+    que cambia en cada petición con probabilidad `change_rate`. Se puede añadir
+    latencia y devolver, con la probabilidad indicada, respuestas 429/503 o la
+    página de captcha. Con `etag`, responde 304 a las peticiones condicionales
+    cuya página no ha cambiado.
+    """
+
+    def __init__(self, pages_dir: str = DEFAULT_PAGES, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, jitter: float = 0.0, throttle_rate: float = 0.0,
+                 captcha_rate: float = 0.0, change_rate: float = 0.0, etag: bool = False, seed: int = None):
+        self.pages, self.captcha = self._load_pages(pages_dir)
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.captcha_rate = captcha_rate
+        self.change_rate = change_rate
+        self.etag = etag
+        self.random = random.Random(seed)
+        self.prices = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @staticmethod
+    def _load_pages(pages_dir):
+        pages, captcha = [], None
+        for name in sorted(os.listdir(pages_dir)):
+            if not name.endswith(".html"):
+                continue
+            with open(os.path.join(pages_dir, name), encoding="utf-8") as page:
+                html = page.read()
+            if name == CAPTCHA_PAGE:
+                captcha = html
+            elif PRICE_WHOLE_PATTERN.search(html):
+                pages.append(html)
+        if not pages:
+            raise ValueError(f"No hay páginas de producto con precio en {pages_dir}")
+        return pages, captcha
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def page_for(self, key: str) -> bytes:
+        """
+        Página de producto de `key` (ASIN o ruta) con su precio actual.
+        """
+        digest = int(hashlib.md5(key.encode()).hexdigest(), 16)
+        with self.lock:
+            price = self.prices.get(key)
+            if price is None or self.random.random() < self.change_rate:
+                price = self.random.randint(5, 500)
+                self.prices[key] = price
+        html = PRICE_WHOLE_PATTERN.sub(rf"\g<1>{price}", self.pages[digest % len(self.pages)])
+        return html.encode("utf-8")
+
+    def _handler_class(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Cabeceras y cuerpo van en escrituras separadas: sin esto, Nagle y el ACK
+            # retardado añaden ~40 ms a cada respuesta keep-alive
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body=b"", headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with replay.lock:
+                    replay.requests += 1
+                    roll = replay.random.random()
+                delay = replay.latency + replay.random.uniform(0, replay.jitter)
+                if delay > 0:
+                    time.sleep(delay)
+
+                if roll < replay.throttle_rate:
+                    self._reply(429 if roll < replay.throttle_rate / 2 else 503, headers={"Retry-After": "1"})
+                    return
+                if roll < replay.throttle_rate + replay.captcha_rate and replay.captcha is not None:
+                    self._reply(200, replay.captcha.encode("utf-8"), {"Content-Type": "text/html; charset=utf-8"})
+                    return
+
+                body = replay.page_for(extract_asin(self.path) or self.path)
+                headers = {"Content-Type": "text/html; charset=utf-8"}
+                if replay.etag:
+                    tag = '"' + hashlib.md5(body).hexdigest() + '"'
+                    if self.headers.get("If-None-Match") == tag:
+                        self._reply(304, headers={"ETag": tag})
+                        return
+                    headers["ETag"] = tag
+                self._reply(200, body, headers)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Transporte de httpx que envía cualquier petición (p. ej. a www.amazon.es)
+    al servidor de réplica, conservando la ruta. Se instala con
+    `http_client.set_async_transport`.
+    """
+
+    def __init__(self, base_url: str, limits: httpx.Limits = None):
+        self.base = httpx.URL(base_url)
+        self.transport = httpx.AsyncHTTPTransport(limits=limits or httpx.Limits())
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme=self.base.scheme, host=self.base.host, port=self.base.port)
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita las páginas de producto de Amazon.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pages", default=DEFAULT_PAGES, help="directorio con las páginas guardadas")
+    parser.add_argument("--latency", type=float, default=0.0, help="latencia por respuesta, en segundos")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latencia aleatoria añadida, en segundos")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="proporción de respuestas 429/503")
+    parser.add_argument("--captcha-rate", type=float, default=0.0, help="proporción de páginas de captcha")
+    parser.add_argument("--change-rate", type=float, default=0.0, help="probabilidad de cambio de precio por petición")
+    parser.add_argument("--etag", action="store_true", help="enviar ETag y responder 304 si la página no cambia")
+    args = parser.parse_args()
+
+    server = ReplayServer(args.pages, port=args.port, latency=args.latency, jitter=args.jitter,
+                          throttle_rate=args.throttle_rate, captcha_rate=args.captcha_rate,
+                          change_rate=args.change_rate, etag=args.etag)
+    print(f"Sirviendo {len(server.pages)} páginas en {server.url} (Ctrl+C para salir)")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+# retry.py
+import asyncio
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import (
+    RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_BUDGET_RATIO,
+    BREAKER_THRESHOLD, BREAKER_COOLDOWN, BREAKER_MAX_COOLDOWN,
+)
+from http_client import HTTP_NOT_MODIFIED
+from metrics import HTTP_RESPONSES, FETCH_RETRIES, CIRCUIT_OPEN
+
+# Respuestas con las que Amazon indica que estamos pidiendo demasiado rápido
+THROTTLE_STATUSES = {429, 503}
+RETRY_STATUSES = {500, 502, 504}
+
+# Resultado de clasificar una respuesta o un error
+OK = "ok"
+RETRY = "retry"
+THROTTLED = "throttled"
+FATAL = "fatal"
+
+# Marcas de la página de captcha que Amazon sirve con estado 200
+CAPTCHA_MARKERS = (b"/errors/validateCaptcha", b'id="captchacharacters"')
+
+
+class FetchError(Exception):
+    """Error de descarga que no procede de httpx."""
+
+
+class CaptchaError(FetchError):
+    """Amazon ha respondido con una página de captcha."""
+
+
+class CircuitOpenError(FetchError):
+    """El dominio está en pausa tras detectar que nos está limitando."""
+
+
+def is_captcha(response: httpx.Response) -> bool:
+    head = response.content[:20000]
+    return any(marker in head for marker in CAPTCHA_MARKERS)
+
+
+def classify(response: httpx.Response = None, error: Exception = None) -> str:
+    """
+    Clasifica el resultado de una petición.
+
+    Returns:
+        str: OK, RETRY (error transitorio), THROTTLED (429/503/captcha) o
+        FATAL (no tiene sentido reintentar, p. ej. 404).
+    """
+    if error is not None:
+        # Timeouts y errores de conexión son transitorios
+        return RETRY if isinstance(error, httpx.TransportError) else FATAL
+
+    status = response.status_code
+    if status in THROTTLE_STATUSES:
+        return THROTTLED
+    if status in RETRY_STATUSES:
+        return RETRY
+    if status == HTTP_NOT_MODIFIED:
+        return OK
+    if response.is_success:
+        return THROTTLED if is_captcha(response) else OK
+    return FATAL
+
+
+def retry_after(response: httpx.Response):
+    """
+    Segundos indicados en la cabecera Retry-After, si los hay.
+    """
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After", "")
+    return float(value) if value.isdigit() else None
+
+
+class RetryPolicy:
+    """
+    Backoff exponencial con jitter completo: la espera del intento `n` es
+    aleatoria entre 0 y min(max_delay, base_delay * 2**n).
+    """
+
+    def __init__(self, max_attempts: int = RETRY_MAX_ATTEMPTS,
+                 base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, server_delay: float = None) -> float:
+        if server_delay is not None:
+            return min(self.max_delay, server_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class RetryBudget:
+    """
+    Limita los reintentos de un barrido a una fracción de las peticiones hechas,
+    para que una racha de errores no multiplique el tráfico.
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, minimum: int = 10):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.requests = 0
+        self.retries = 0
+
+    def record_request(self):
+        self.requests += 1
+
+    def try_spend(self) -> bool:
+        if self.retries >= max(self.minimum, self.ratio * self.requests):
+            return False
+        self.retries += 1
+        return True
+
+
+class CircuitBreaker:
+    """
+    Pausa un dominio tras `threshold` respuestas de bloqueo seguidas.
+
+    Pasada la pausa se deja pasar una sola petición de prueba (las demás siguen
+    rechazándose mientras está en curso): si vuelve a haber bloqueo, la pausa se
+    duplica (hasta `max_cooldown`); si va bien, el circuito se cierra; si falla
+    por otro motivo, se repite la pausa y luego se prueba de nuevo.
+    """
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN,
+                 max_cooldown: float = BREAKER_MAX_COOLDOWN):
+        self.threshold = max(1, threshold)
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_until = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if time.monotonic() < self.opened_until:
+                return False
+            if self.opened_until:
+                # Pausa terminada: solo pasa la petición de prueba
+                if self.probing:
+                    return False
+                self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_until = 0.0
+            self.probing = False
+            self.cooldown = self.base_cooldown
+
+    def record_throttle(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                if self.probing:
+                    self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                self.opened_until = time.monotonic() + self.cooldown
+                self.failures = 0
+                self.probing = False
+
+    def record_failure(self):
+        """
+        Error que no es de bloqueo (red, 5xx, 404...). Si era la petición de
+        prueba, no dice nada del dominio: se repite la pausa sin alargarla.
+        """
+        with self.lock:
+            if self.probing:
+                self.opened_until = time.monotonic() + self.cooldown
+                self.probing = False
+
+
+class CircuitBreakers:
+    """Un `CircuitBreaker` por dominio, compartido por todo el proceso."""
+
+    def __init__(self):
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def for_url(self, url: str) -> CircuitBreaker:
+        host = urlsplit(url).hostname or ""
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker()
+            return self.breakers[host]
+
+
+breakers = CircuitBreakers()
+
+
+def _record_attempt(host, response, error, outcome):
+    # Código de la respuesta; las páginas de captcha (200) se cuentan aparte
+    if error is not None:
+        status = "error"
+    elif outcome == THROTTLED and response.is_success:
+        status = "captcha"
+    else:
+        status = response.status_code
+    HTTP_RESPONSES.inc(host=host, status=status)
+
+
+def _raise_for_outcome(url, response, error, outcome):
+    if error is not None:
+        raise error
+    if outcome == THROTTLED and response.is_success:
+        raise CaptchaError(f"Página de captcha para {url}")
+    response.raise_for_status()
+
+
+async def send_with_retry(send, url: str, policy: RetryPolicy, budget: RetryBudget = None) -> httpx.Response:
+    """
+    Ejecuta `send()` (corrutina que devuelve un httpx.Response) reintentando
+    los errores transitorios con backoff exponencial, sin bloquear el bucle
+    de eventos.
+
+    Raises:
+        CircuitOpenError: Si el dominio está en pausa.
+        CaptchaError: Si tras los reintentos Amazon sigue sirviendo un captcha.
+        httpx.HTTPError: Si la petición falla de forma definitiva.
+    """
+    breaker = breakers.for_url(url)
+    host = urlsplit(url).hostname or ""
+    for attempt in range(policy.max_attempts):
+        if not breaker.allow():
+            CIRCUIT_OPEN.inc(host=host)
+            raise CircuitOpenError(f"Dominio en pausa: {url}")
+        if budget is not None:
+            budget.record_request()
+
+        response, error = None, None
+        try:
+            response = await send()
+        except httpx.HTTPError as e:
+            error = e
+        except BaseException:
+            # Cancelada u otro error: la petición de prueba no puede quedar abierta
+            breaker.record_failure()
+            raise
+        outcome = classify(response, error)
+        _record_attempt(host, response, error, outcome)
+
+        if outcome == OK:
+            breaker.record_success()
+            return response
+        if outcome == THROTTLED:
+            breaker.record_throttle()
+        else:
+            breaker.record_failure()
+
+        last_attempt = attempt + 1 >= policy.max_attempts
+        if outcome == FATAL or last_attempt or (budget is not None and not budget.try_spend()):
+            _raise_for_outcome(url, response, error, outcome)
+        FETCH_RETRIES.inc(host=host, outcome=outcome)
+        await asyncio.sleep(policy.delay(attempt, retry_after(response)))
+
+
+def send_with_retry_sync(send, url: str, policy: RetryPolicy) -> httpx.Response:
+    """
+    Versión síncrona de `send_with_retry` para scripts y la GUI.
+    """
+    breaker = breakers.for_url(url)
+    host = urlsplit(url).hostname or ""
+    for attempt in range(policy.max_attempts):
+        if not breaker.allow():
+            CIRCUIT_OPEN.inc(host=host)
+            raise CircuitOpenError(f"Dominio en pausa: {url}")
+
+        response, error = None, None
+        try:
+            response = send()
+        except httpx.HTTPError as e:
+            error = e
+        except BaseException:
+            breaker.record_failure()
+            raise
+        outcome = classify(response, error)
+        _record_attempt(host, response, error, outcome)
+
+        if outcome == OK:
+            breaker.record_success()
+            return response
+        if outcome == THROTTLED:
+            breaker.record_throttle()
+        else:
+            breaker.record_failure()
+
+        if outcome == FATAL or attempt + 1 >= policy.max_attempts:
+            _raise_for_outcome(url, response, error, outcome)
+        FETCH_RETRIES.inc(host=host, outcome=outcome)
+        wait_time = policy.delay(attempt, retry_after(response))
+        print(f"Reintentando ({attempt + 1}/{policy.max_attempts})... Esperando {wait_time:.2f} segundos.")
+        time.sleep(wait_time)
@@ -0,0 +1,304 @@
+# scheduler.py
+import asyncio
+import heapq
+import random
+import threading
+import time
+
+from async_database import (
+    get_all_products, get_change_frequencies, start_sweep, checkpoint_sweep, finish_sweep,
+)
+from checker import plan_sweep
+from config import (
+    CHECK_INTERVAL, SCHEDULER_MIN_INTERVAL, SCHEDULER_MAX_INTERVAL,
+    SCHEDULER_RPM, SCHEDULER_CONCURRENCY, SCHEDULER_RESYNC, SWEEP_CHECKPOINT,
+)
+from metrics import SCHEDULE_LAG, SWEEP_SECONDS
+
+# Revisiones por cada cambio de precio esperado (2 = se revisa dos veces entre cambios)
+CHECKS_PER_CHANGE = 2
+# Factores con los que se ajusta el intervalo tras cada revisión
+SPEED_UP = 0.5
+SLOW_DOWN = 1.25
+# Espera máxima entre dos pasadas del bucle, en segundos
+TICK = 10.0
+# Presupuesto automático: margen sobre las revisiones que piden los intervalos y mínimo, por minuto
+RPM_HEADROOM = 1.5
+MIN_AUTO_RPM = 60.0
+
+
+class AdaptiveScheduler:
+    """
+    Planificador de revisiones por producto.
+
+    Cada producto tiene su propio intervalo, estimado a partir de la frecuencia
+    con la que ha cambiado su precio en `price_history` y ajustado después de
+    cada revisión: se acorta a la mitad si el precio ha cambiado y se alarga
+    poco a poco si no, siempre entre `min_interval` y `max_interval`.
+
+    Los productos pendientes se guardan en un montículo ordenado por la hora
+    de la próxima revisión, y un presupuesto global de `rpm` peticiones por
+    minuto reparte la carga de forma uniforme en lugar de en ráfagas. Con
+    `rpm` 0, el presupuesto se calcula a partir de los intervalos de todos
+    los productos. Hasta `concurrency` lotes se revisan a la vez, de modo que
+    un dominio lento o con reintentos no retrasa al resto.
+
+    `check` es la corrutina que revisa un lote de productos (`plan` ->
+    item_id -> cambiado), p. ej. `price_checker.check_items` en el bot.
+    """
+
+    def __init__(self, check, min_interval: float = SCHEDULER_MIN_INTERVAL,
+                 max_interval: float = SCHEDULER_MAX_INTERVAL, rpm: float = SCHEDULER_RPM,
+                 default_interval: float = CHECK_INTERVAL, resync: float = SCHEDULER_RESYNC,
+                 concurrency: int = SCHEDULER_CONCURRENCY):
+        self.check = check
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.default_interval = self.clamp(default_interval)
+        self.auto_rpm = rpm <= 0
+        self.set_rpm(MIN_AUTO_RPM if self.auto_rpm else rpm)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.underfunded = False
+        self.resync_interval = resync
+        self.next_resync = 0.0
+        self.slots = asyncio.Semaphore(max(1, concurrency))
+        self.tasks = set()
+
+        self.heap = []       # (hora de la próxima revisión, item_id)
+        self.due = {}        # item_id -> hora de la próxima revisión (invalida entradas viejas del montículo)
+        self.intervals = {}  # item_id -> intervalo actual, en segundos
+        self.plan = {}       # item_id -> (URL, suscriptores)
+
+    def clamp(self, interval: float) -> float:
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def estimate_interval(self, changes: int, span: float) -> float:
+        """
+        Intervalo inicial a partir del historial: una fracción del tiempo medio entre cambios.
+        """
+        if changes < 2 or span <= 0:
+            return self.default_interval
+        return self.clamp(span / (changes - 1) / CHECKS_PER_CHANGE)
+
+    def next_interval(self, interval: float, changed: bool) -> float:
+        """
+        Intervalo tras una revisión: la mitad si el precio ha cambiado, algo más largo si no
+        y el mismo si la descarga falló (`changed` None).
+        """
+        if changed is None:
+            return interval
+        return self.clamp(interval * (SPEED_UP if changed else SLOW_DOWN))
+
+    def set_rpm(self, rpm: float):
+        self.rpm = max(rpm, 1.0)
+        self.rate = self.rpm / 60
+        self.capacity = max(1.0, self.rate * TICK)
+
+    def budget(self, items: int, demand: float):
+        """
+        Ajusta el presupuesto a `items` productos que piden `demand` revisiones por
+        minuto con sus intervalos actuales. Con un `rpm` fijo, avisa si no alcanza
+        ni para revisar cada producto una vez por `max_interval`: el retraso de las
+        revisiones crecería sin límite.
+        """
+        if self.auto_rpm:
+            self.set_rpm(max(MIN_AUTO_RPM, demand * RPM_HEADROOM))
+            self.tokens = min(self.tokens, self.capacity)
+            return
+        required = items * 60 / self.max_interval
+        underfunded = self.rpm < required
+        if underfunded and not self.underfunded:
+            print(f"Aviso: SCHEDULER_RPM={self.rpm:g} no alcanza para {items} productos; "
+                  f"hacen falta al menos {required:.0f} peticiones por minuto (o SCHEDULER_RPM=0).")
+        self.underfunded = underfunded
+
+    def refill(self, now: float):
+        """
+        Recarga el presupuesto de peticiones con el tiempo transcurrido.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def schedule(self, item_id, at: float):
+        self.due[item_id] = at
+        heapq.heappush(self.heap, (at, item_id))
+
+    def sync(self, plan: dict, frequencies: dict, now: float = None):
+        """
+        Incorpora los productos nuevos de `plan` y olvida los que ya nadie sigue.
+
+        Los productos nuevos se reparten al azar dentro de su primer intervalo
+        para no revisarlos todos a la vez.
+        """
+        now = time.monotonic() if now is None else now
+        for item_id in set(self.plan) - set(plan):
+            self.due.pop(item_id, None)
+            self.intervals.pop(item_id, None)
+        for item_id in plan:
+            if item_id not in self.intervals:
+                interval = self.estimate_interval(*frequencies.get(item_id, (0, 0.0)))
+                self.intervals[item_id] = interval
+                self.schedule(item_id, now + random.uniform(0, interval))
+        self.plan = plan
+        self.budget(len(self.intervals), sum(60 / interval for interval in self.intervals.values()))
+
+    def record(self, item_id, changed: bool, now: float = None):
+        """
+        Ajusta el intervalo de un producto tras revisarlo y programa la siguiente revisión.
+
+        Args:
+            changed (bool): True si el precio ha cambiado, False si no, None si la descarga falló
+                (se mantiene el intervalo).
+        """
+        if item_id not in self.intervals:
+            return
+        now = time.monotonic() if now is None else now
+        interval = self.intervals[item_id] = self.next_interval(self.intervals[item_id], changed)
+        self.schedule(item_id, now + interval)
+
+    def take_due(self, now: float = None) -> list:
+        """
+        Saca del montículo los productos ya pendientes que permite el presupuesto de peticiones.
+        """
+        now = time.monotonic() if now is None else now
+        self.refill(now)
+
+        batch = []
+        while self.heap and self.tokens >= 1 and self.heap[0][0] <= now:
+            at, item_id = heapq.heappop(self.heap)
+            if self.due.get(item_id) != at:
+                continue  # Entrada antigua o producto eliminado
+            del self.due[item_id]
+            self.tokens -= 1
+            batch.append(item_id)
+            SCHEDULE_LAG.observe(now - at)
+        return batch
+
+    def next_wakeup(self, now: float) -> float:
+        """
+        Segundos hasta que haya algo que hacer (como mucho TICK).
+        """
+        wait = TICK
+        if self.heap:
+            wait = min(wait, self.heap[0][0] - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return max(0.1, wait)
+
+    async def resync(self):
+        plan = plan_sweep(await get_all_products())
+        # El historial solo se consulta si hay productos nuevos que estimar
+        frequencies = await get_change_frequencies() if set(plan) - set(self.intervals) else {}
+        self.sync(plan, frequencies)
+
+    def start(self, coro):
+        """
+        Lanza la revisión de un lote como tarea; libera su hueco al terminar.
+        """
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task):
+        self.tasks.discard(task)
+        self.slots.release()
+
+    async def check_batch(self, plan: dict):
+        try:
+            checked = await self.check(plan)
+        except Exception as e:
+            print(f"Error al revisar los precios: {e}")
+            checked = {}
+        now = time.monotonic()
+        for item_id in plan:
+            self.record(item_id, checked.get(item_id), now)
+
+    async def run(self):
+        """
+        Bucle principal: revisa los productos a medida que les toca.
+        """
+        while True:
+            now = time.monotonic()
+            if now >= self.next_resync:
+                try:
+                    await self.resync()
+                except Exception as e:
+                    print(f"No se pudieron leer los productos: {e}")
+                self.next_resync = now + self.resync_interval
+
+            # Si todos los huecos están ocupados, se espera a que termine algún lote
+            await self.slots.acquire()
+            now = time.monotonic()
+            batch = self.take_due(now)
+            if not batch:
+                self.slots.release()
+                await asyncio.sleep(self.next_wakeup(now))
+                continue
+            self.start(self.check_batch({item_id: self.plan[item_id] for item_id in batch}))
+
+
+class SweepCoordinator:
+    """
+    Ejecuta barridos completos de todos los productos.
+
+    Garantiza que nunca haya más de un barrido activo a la vez (un barrido
+    lento no se solapa con el siguiente) y guarda en la tabla `sweeps` el
+    último producto revisado cada `checkpoint` productos, de modo que tras
+    un reinicio el barrido interrumpido continúa donde se quedó. `check`
+    revisa cada bloque de productos, como en `AdaptiveScheduler`.
+    """
+
+    def __init__(self, check, checkpoint: int = SWEEP_CHECKPOINT):
+        self.check = check
+        self.checkpoint = max(1, checkpoint)
+        self.lock = threading.Lock()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def running(self) -> bool:
+        return self.lock.locked()
+
+    @property
+    def duration(self):
+        """
+        Duración del barrido actual o del último, en segundos.
+        """
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    async def run(self) -> bool:
+        """
+        Ejecuta (o retoma) un barrido completo.
+
+        Returns:
+            bool: False si ya había un barrido en curso y no se ha hecho nada.
+        """
+        if not self.lock.acquire(blocking=False):
+            print("Ya hay un barrido en curso; se omite este.")
+            return False
+        try:
+            self.started_at, self.finished_at = time.time(), None
+            sweep_id, last_item_id = await start_sweep()
+            if last_item_id:
+                print(f"Retomando el barrido {sweep_id} a partir del producto {last_item_id}.")
+
+            # Los productos llegan ordenados por id: el último de cada bloque es el punto de control
+            plan = plan_sweep(await get_all_products(last_item_id))
+            item_ids = list(plan)
+            for start in range(0, len(item_ids), self.checkpoint):
+                chunk = item_ids[start:start + self.checkpoint]
+                checked = await self.check({item_id: plan[item_id] for item_id in chunk})
+                await checkpoint_sweep(sweep_id, chunk[-1], len(checked), sum(checked.values()))
+
+            await finish_sweep(sweep_id)
+            self.finished_at = time.time()
+            SWEEP_SECONDS.observe(self.duration)
+            print(f"Barrido {sweep_id} completado en {self.duration:.1f} s ({len(item_ids)} productos).")
+            return True
+        finally:
+            if self.finished_at is None:
+                self.finished_at = time.time()
+            self.lock.release()
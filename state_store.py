@@ -0,0 +1,81 @@
+# state_store.py
+import json
+import time
+from collections import OrderedDict
+
+from async_database import get_conversation_state, set_conversation_state, delete_conversation_state
+from config import STATE_BACKEND, STATE_TTL, STATE_MAX_USERS
+
+
+class MemoryStateStore:
+    """
+    Paso del menú en el que está cada usuario, guardado en memoria.
+
+    Las conversaciones abandonadas caducan a los `ttl` segundos y nunca se
+    guardan más de `max_entries` (se olvidan primero las menos recientes), así
+    que la memoria no crece aunque muchos usuarios dejen el menú a medias.
+    """
+
+    def __init__(self, ttl: float = STATE_TTL, max_entries: int = STATE_MAX_USERS):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.entries = OrderedDict()  # user_id -> (estado, hora de caducidad)
+
+    async def get(self, user_id) -> dict:
+        """
+        Estado de la conversación del usuario, o None si no tiene o ha caducado.
+        """
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        state, expires_at = entry
+        if expires_at < time.time():
+            del self.entries[user_id]
+            return None
+        self.entries.move_to_end(user_id)
+        return state
+
+    async def set(self, user_id, state: dict):
+        self.entries[user_id] = (state, time.time() + self.ttl)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def pop(self, user_id):
+        self.entries.pop(user_id, None)
+
+
+class SQLiteStateStore:
+    """
+    Misma API que `MemoryStateStore`, con los estados guardados en la tabla
+    `conversation_states`: sobreviven a un reinicio del bot y los comparten
+    todos los procesos que usan la misma base de datos.
+    """
+
+    def __init__(self, ttl: float = STATE_TTL, max_entries: int = STATE_MAX_USERS):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+
+    async def get(self, user_id) -> dict:
+        state = await get_conversation_state(user_id, time.time())
+        return json.loads(state) if state is not None else None
+
+    async def set(self, user_id, state: dict):
+        now = time.time()
+        await set_conversation_state(user_id, json.dumps(state), now + self.ttl, now, self.max_entries)
+
+    async def pop(self, user_id):
+        await delete_conversation_state(user_id)
+
+
+STATE_BACKENDS = {"memory": MemoryStateStore, "sqlite": SQLiteStateStore}
+
+
+def create_state_store(backend: str = STATE_BACKEND):
+    if backend not in STATE_BACKENDS:
+        raise ValueError(f"STATE_BACKEND desconocido: {backend} (usa memory o sqlite)")
+    return STATE_BACKENDS[backend]()
+
+
+# Estados de las conversaciones del menú de todos los usuarios
+user_states = create_state_store()
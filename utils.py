@@ -1,8 +1,52 @@
 # utils.py
 import re
+from datetime import timedelta
+from urllib.parse import urlsplit, urlunsplit
 
 # Validar si la URL es válida para Amazon
 def is_valid_amazon_url(url: str) -> bool:
     return bool(re.match(r'https?://(www\.)?amazon\.\w{2,3}/', url))
 
-user_states = {}
+# Rutas en las que Amazon incluye el ASIN del producto
+ASIN_PATTERN = re.compile(r'/(?:dp|gp/product|gp/aw/d|exec/obidos/asin|o/asin)/([A-Z0-9]{10})(?:[/?]|$)', re.IGNORECASE)
+
+# Extraer el marketplace (amazon.es, amazon.co.uk, ...) de una URL
+def get_marketplace(url: str) -> str:
+    host = (urlsplit(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+# Extraer el ASIN de una URL de Amazon, si lo contiene
+def extract_asin(url: str):
+    match = ASIN_PATTERN.search(urlsplit(url).path)
+    return match.group(1).upper() if match else None
+
+# Reducir una URL de Amazon a su forma canónica (marketplace + ASIN)
+def canonicalize_url(url: str) -> str:
+    url = url.strip()
+    marketplace = get_marketplace(url)
+    asin = extract_asin(url)
+    if marketplace and asin:
+        return f"https://www.{marketplace}/dp/{asin}"
+
+    # Sin ASIN: descartar parámetros de seguimiento y fragmento
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme or "https", parts.netloc.lower(), parts.path.rstrip("/"), "", ""))
+
+# Clave única de un producto en la base de datos: (marketplace, ASIN)
+def get_item_key(url: str) -> tuple:
+    canonical_url = canonicalize_url(url)
+    # Sin ASIN, la URL canónica identifica al producto
+    return get_marketplace(canonical_url), extract_asin(canonical_url) or canonical_url
+
+# Ventanas de tiempo como "7d", "12h", "4w", "6m" o "1y"
+WINDOW_PATTERN = re.compile(r'^(\d+)([hdwmy])$', re.IGNORECASE)
+WINDOW_UNITS = {"h": timedelta(hours=1), "d": timedelta(days=1), "w": timedelta(weeks=1),
+                "m": timedelta(days=30), "y": timedelta(days=365)}
+
+# Convertir una ventana de tiempo ("7d", "30d", "1y", ...) en un timedelta, o None si no es válida
+def parse_window(text: str):
+    match = WINDOW_PATTERN.match(text.strip())
+    if not match or int(match.group(1)) == 0:
+        return None
+    return int(match.group(1)) * WINDOW_UNITS[match.group(2).lower()]
+
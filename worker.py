@@ -0,0 +1,130 @@
+# worker.py
+import asyncio
+import os
+import random
+import socket
+import time
+
+from async_database import (
+    background_db, get_unscheduled_items, add_scrape_jobs, lease_scrape_jobs, complete_scrape_jobs, get_next_job_due,
+    get_change_frequencies, get_scrape_demand, queue_notifications,
+)
+from checker import check_items
+from config import WORKER_BATCH, WORKER_LEASE, WORKER_METRICS_PORT, METRICS_HOST
+from database import init_db
+from metrics import SCHEDULE_LAG, start_metrics_server
+from parse_pool import parse_pool
+from scheduler import AdaptiveScheduler, TICK
+
+
+class JobWorker(AdaptiveScheduler):
+    """
+    Worker de revisión de precios (`main.py --run-worker`).
+
+    La cola de revisiones no es un montículo en memoria sino la tabla compartida
+    `scrape_jobs`: cada worker reserva durante `lease` segundos un lote de
+    revisiones vencidas, las revisa, deja los avisos en la base de datos para
+    que los envíe el bot y programa la siguiente revisión de cada producto con
+    el mismo intervalo adaptativo y el mismo presupuesto de peticiones por
+    minuto que el planificador del bot. Varios workers pueden trabajar a la vez
+    sobre la misma base de datos; si uno se cae, sus reservas caducan y las
+    retoma otro.
+    """
+
+    def __init__(self, batch_size: int = WORKER_BATCH, lease: float = WORKER_LEASE, **kwargs):
+        # Los avisos se guardan en la base de datos; los envía el bot
+        super().__init__(lambda plan: check_items(plan, queue_notifications), **kwargs)
+        self.batch_size = max(1, batch_size)
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def resync(self):
+        """
+        Programa los productos recién añadidos (repartidos al azar dentro de su
+        primer intervalo), olvida los que ya nadie sigue y ajusta el presupuesto
+        de peticiones a la cola compartida.
+        """
+        item_ids = await get_unscheduled_items()
+        if item_ids:
+            frequencies = await get_change_frequencies()
+            now = time.time()
+            jobs = []
+            for item_id in item_ids:
+                interval = self.estimate_interval(*frequencies.get(item_id, (0, 0.0)))
+                jobs.append((item_id, now + random.uniform(0, interval), interval))
+            await add_scrape_jobs(jobs)
+        self.budget(*await get_scrape_demand())
+
+    async def wait_for_jobs(self, now: float):
+        # Hasta la próxima revisión vencida (o reserva caducada), como mucho TICK
+        next_due = await get_next_job_due(now)
+        wait = TICK if next_due is None else min(TICK, next_due - now)
+        await asyncio.sleep(max(0.1, wait))
+
+    async def check_jobs(self, jobs: list):
+        try:
+            checked = await self.check({item_id: (url, []) for item_id, url, _, _ in jobs})
+        except Exception as e:
+            print(f"Error al revisar los precios: {e}")
+            checked = {}
+
+        finished = time.time()
+        completed = []
+        for item_id, _, _, interval in jobs:
+            interval = self.next_interval(interval, checked.get(item_id))
+            completed.append((item_id, finished + interval, interval))
+        await complete_scrape_jobs(self.owner, completed)
+
+    async def run(self):
+        """
+        Bucle principal: reserva, revisa y reprograma lotes de productos.
+        """
+        while True:
+            now = time.monotonic()
+            if now >= self.next_resync:
+                try:
+                    await self.resync()
+                except Exception as e:
+                    print(f"No se pudieron programar los productos nuevos: {e}")
+                self.next_resync = now + self.resync_interval
+
+            self.refill(now)
+            limit = min(self.batch_size, int(self.tokens))
+            if limit < 1:
+                await asyncio.sleep(self.next_wakeup(now))
+                continue
+
+            # Si todos los huecos están ocupados, se espera a que termine algún lote
+            await self.slots.acquire()
+            # La cola es compartida entre procesos y máquinas: se usa la hora real
+            jobs = await lease_scrape_jobs(self.owner, limit, self.lease, time.time())
+            if not jobs:
+                self.slots.release()
+                await self.wait_for_jobs(time.time())
+                continue
+            self.tokens -= len(jobs)
+            started = time.time()
+            for _, _, due_at, _ in jobs:
+                SCHEDULE_LAG.observe(max(0.0, started - due_at))
+
+            self.start(self.check_jobs(jobs))
+
+
+def run_worker():
+    """
+    Ejecuta un worker de revisión de precios hasta que se interrumpa.
+    """
+    init_db()
+    if WORKER_METRICS_PORT:
+        start_metrics_server(WORKER_METRICS_PORT, METRICS_HOST)
+        print(f"Métricas disponibles en http://{METRICS_HOST}:{WORKER_METRICS_PORT}/metrics")
+
+    worker = JobWorker()
+    print(f"Worker {worker.owner} en marcha.")
+    try:
+        with background_db():
+            asyncio.run(worker.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        parse_pool.close()